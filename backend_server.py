@@ -1,27 +1,1213 @@
 # backend_server.py - Fixed for Cloud Deployment (No Browser Cookies)
-from flask import Flask, request, jsonify, send_file
+import time
+STARTUP_BEGAN = time.perf_counter()
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
-import yt_dlp
+import zipfile
+import signal
+from contextlib import contextmanager
 import os
 import tempfile
 import threading
-import time
 import random
-from urllib.parse import urlparse, parse_qs
+import functools
+import importlib
+from types import MappingProxyType
+import bisect
+from collections import deque, OrderedDict
+from urllib.parse import urlparse, parse_qs, quote
 import json
+import copy
+import hashlib
+import shutil
+import sqlite3
+import uuid
+
+class LazyModule:
+    """Module proxy that imports on first attribute access
+
+    yt-dlp and its extractors are the slowest imports here, so a process
+    only pays for them when it first needs them. gunicorn.conf.py warms them
+    up once in the master so forked workers start with them loaded.
+    """
+
+    def __init__(self, *names):
+        self.names = names
+        self.import_seconds = None
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    modules = [importlib.import_module(name) for name in self.names]
+                    self.import_seconds = round(time.perf_counter() - started, 3)
+                    self._module = modules[0]
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+yt_dlp = LazyModule('yt_dlp', 'yt_dlp.postprocessor')
 
 app = Flask(__name__)
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
 CORS(app, origins=["https://oae2.github.io", "http://localhost:*"])
 
-# Global dict to store conversion progress
-conversion_status = {}
+# Conversion scheduler limits (override via environment); downloads are
+# network-bound, ffmpeg postprocessing is CPU-bound and defaults to one per core
+MAX_CONVERSION_WORKERS = int(os.environ.get('MAX_CONVERSION_WORKERS', 2))
+MAX_POSTPROCESS_WORKERS = int(os.environ.get('MAX_POSTPROCESS_WORKERS', os.cpu_count() or 1))
+MAX_PENDING_CONVERSIONS = int(os.environ.get('MAX_PENDING_CONVERSIONS', 20))
+QUEUE_RETRY_AFTER = int(os.environ.get('QUEUE_RETRY_AFTER', 30))
+
+# Fair-share scheduling across clients (override via environment). Clients are
+# identified by X-API-Token when it is listed in API_TOKENS ("token=weight,..."),
+# otherwise by IP; TRUSTED_PROXY_HOPS is the number of proxies appending to
+# X-Forwarded-For (0 = ignore the header and use the socket address). Job cost
+# is the video duration in seconds.
+MAX_CLIENT_PENDING_CONVERSIONS = int(os.environ.get('MAX_CLIENT_PENDING_CONVERSIONS', max(MAX_PENDING_CONVERSIONS // 4, 1)))
+MAX_CLIENT_ACTIVE_CONVERSIONS = int(os.environ.get('MAX_CLIENT_ACTIVE_CONVERSIONS', 0))  # 0 = no limit
+API_TOKENS = os.environ.get('API_TOKENS', '')
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+DEFAULT_JOB_COST = float(os.environ.get('DEFAULT_JOB_COST', 600))
+
+# Video metadata cache (override via environment)
+VIDEO_INFO_CACHE_TTL = int(os.environ.get('VIDEO_INFO_CACHE_TTL', 600))
+VIDEO_INFO_CACHE_SIZE = int(os.environ.get('VIDEO_INFO_CACHE_SIZE', 256))
+# Seconds of validity a cached stream URL must still have to be reused
+STREAM_URL_EXPIRY_MARGIN = int(os.environ.get('STREAM_URL_EXPIRY_MARGIN', 300))
+
+# Converted output cache (override via environment)
+OUTPUT_CACHE_DIR = os.environ.get('OUTPUT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'yt-converter-cache'))
+OUTPUT_CACHE_MAX_BYTES = int(os.environ.get('OUTPUT_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+# Job scratch space and janitor TTLs in seconds (override via environment)
+SCRATCH_DIR = os.environ.get('SCRATCH_DIR', os.path.join(tempfile.gettempdir(), 'yt-converter-jobs'))
+SCRATCH_DISK_QUOTA = int(os.environ.get('SCRATCH_DISK_QUOTA', 5 * 1024 ** 3))
+COMPLETED_JOB_TTL = int(os.environ.get('COMPLETED_JOB_TTL', 1800))
+FAILED_JOB_TTL = int(os.environ.get('FAILED_JOB_TTL', 600))
+UNDOWNLOADED_JOB_TTL = int(os.environ.get('UNDOWNLOADED_JOB_TTL', 3600))
+JANITOR_INTERVAL = int(os.environ.get('JANITOR_INTERVAL', 60))
+# Unfinished jobs nobody has asked about for this long are cancelled
+ABANDONED_JOB_TIMEOUT = int(os.environ.get('ABANDONED_JOB_TIMEOUT', 300))
+
+# Server-Sent Events progress stream (seconds, override via environment)
+SSE_MIN_INTERVAL = float(os.environ.get('SSE_MIN_INTERVAL', 0.5))
+SSE_KEEPALIVE_INTERVAL = float(os.environ.get('SSE_KEEPALIVE_INTERVAL', 15))
+# Long-lived responses (SSE, progressive downloads, batch ZIPs) each hold a
+# server thread; keep this below gunicorn's thread count so short requests
+# always find one. Over the cap, SSE and ZIPs get 503 and clients poll.
+MAX_STREAMING_RESPONSES = int(os.environ.get('MAX_STREAMING_RESPONSES', 8))
+STREAM_RETRY_AFTER = int(os.environ.get('STREAM_RETRY_AFTER', 5))
+
+# Reverse-proxy file offload: ACCEL_REDIRECT_PREFIX is the nginx internal
+# location aliased to ACCEL_REDIRECT_ROOT; USE_X_SENDFILE targets Apache/lighttpd
+ACCEL_REDIRECT_PREFIX = os.environ.get('ACCEL_REDIRECT_PREFIX')
+ACCEL_REDIRECT_ROOT = os.environ.get('ACCEL_REDIRECT_ROOT', tempfile.gettempdir())
+
+# Batch / playlist conversions (override via environment)
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 2))
+BATCH_POLL_INTERVAL = float(os.environ.get('BATCH_POLL_INTERVAL', 1.0))
+
+# Adaptive player-client ordering (override via environment): attempts are
+# scored over a sliding window, and clients failing this many times in a
+# row are skipped until the cool-down (seconds) ends
+EXTRACTOR_WINDOW_SIZE = int(os.environ.get('EXTRACTOR_WINDOW_SIZE', 50))
+EXTRACTOR_WINDOW_SECONDS = int(os.environ.get('EXTRACTOR_WINDOW_SECONDS', 900))
+EXTRACTOR_FAILURE_THRESHOLD = int(os.environ.get('EXTRACTOR_FAILURE_THRESHOLD', 3))
+EXTRACTOR_COOLDOWN = int(os.environ.get('EXTRACTOR_COOLDOWN', 300))
+
+# Formats downloaded as-is, which /api/download can stream while they download
+STREAMABLE_FORMATS = ('mp4', 'webm')
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 256 * 1024))
+
+# Job state backend: 'memory' (single process) or 'sqlite' (shared by all
+# gunicorn workers on the host)
+JOB_STORE = os.environ.get('JOB_STORE', 'memory')
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', os.path.join(tempfile.gettempdir(), 'yt-converter-jobs.db'))
+JOB_STORE_POLL_INTERVAL = float(os.environ.get('JOB_STORE_POLL_INTERVAL', 0.25))
 
 class ConversionProgress:
+    FIELDS = ('progress', 'status', 'file_path', 'error', 'job_id', 'temp_dir',
+              'finished_at', 'downloaded_at', 'queue_position',
+              'stage', 'download_wait', 'postprocess_wait', 'conversion_path',
+              'stream_path', 'stream_total_bytes', 'cancelled', 'last_seen', 'timings',
+              'client', 'cost', 'detached')
+    # Dict-valued fields, stored as JSON by the SQLite job store
+    JSON_FIELDS = ('timings', 'detached')
+    # Assigning any of these wakes up Server-Sent Events listeners
+    WATCHED_FIELDS = ('progress', 'status', 'file_path', 'error', 'finished_at', 'queue_position', 'stage',
+                      'stream_path')
+
     def __init__(self):
+        object.__setattr__(self, 'version', 0)
+        object.__setattr__(self, 'changed', threading.Condition())
         self.progress = 0
         self.status = "Initializing..."
         self.file_path = None
         self.error = None
+        self.job_id = None
+        self.temp_dir = None
+        self.finished_at = None
+        self.downloaded_at = None
+        self.queue_position = None
+        self.stage = None
+        self.download_wait = None
+        self.postprocess_wait = None
+        self.conversion_path = None
+        self.stream_path = None
+        self.stream_total_bytes = None
+        self.cancelled = False
+        self.last_seen = time.time()
+        self.timings = {}
+        self.client = None
+        self.cost = None
+        self.detached = []
+
+    def __setattr__(self, name, value):
+        self.update(**{name: value})
+
+    def update(self, **fields):
+        """Set several fields at once so readers never see a half-applied change"""
+        with self.changed:
+            for name, value in fields.items():
+                object.__setattr__(self, name, value)
+            if any(name in self.WATCHED_FIELDS for name in fields):
+                object.__setattr__(self, 'version', self.version + 1)
+                self.changed.notify_all()
+
+    def snapshot(self):
+        with self.changed:
+            return {name: getattr(self, name) for name in self.FIELDS}
+
+    def wait_for_change(self, version, timeout):
+        """Block until the version moves past the given one or the timeout expires"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+class InMemoryJobStore:
+    """Per-process job store; coalesced conversion IDs share one ConversionProgress"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def create(self, conversion_id):
+        progress = ConversionProgress()
+        progress.job_id = conversion_id
+        with self._lock:
+            self._jobs[conversion_id] = progress
+        return progress
+
+    def alias(self, conversion_id, leader_id):
+        with self._lock:
+            self._jobs[conversion_id] = self._jobs[leader_id]
+
+    def get(self, conversion_id):
+        return self._jobs.get(conversion_id)
+
+    def __getitem__(self, conversion_id):
+        return self._jobs[conversion_id]
+
+    def __contains__(self, conversion_id):
+        return conversion_id in self._jobs
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def conversion_ids(self, conversion_id):
+        """Every conversion ID sharing this conversion's job"""
+        with self._lock:
+            progress = self._jobs.get(conversion_id)
+            return [cid for cid, other in self._jobs.items() if progress is not None and other is progress]
+
+    def jobs(self):
+        """List of (progress, conversion_ids) with aliases grouped per job"""
+        grouped = {}
+        with self._lock:
+            for conversion_id, progress in self._jobs.items():
+                grouped.setdefault(id(progress), (progress, []))[1].append(conversion_id)
+        return list(grouped.values())
+
+    def remove(self, conversion_ids):
+        with self._lock:
+            for conversion_id in conversion_ids:
+                self._jobs.pop(conversion_id, None)
+
+    def save_batch(self, batch_id, record):
+        with self._lock:
+            self._batches[batch_id] = copy.deepcopy(record)
+
+    def get_batch(self, batch_id):
+        with self._lock:
+            record = self._batches.get(batch_id)
+            return copy.deepcopy(record) if record is not None else None
+
+    def batch_ids(self):
+        with self._lock:
+            return list(self._batches)
+
+    def remove_batch(self, batch_id):
+        with self._lock:
+            self._batches.pop(batch_id, None)
+
+class SQLiteConversionProgress:
+    """ConversionProgress view backed by a row in the SQLite job store"""
+
+    def __init__(self, store, job_id):
+        object.__setattr__(self, '_store', store)
+        object.__setattr__(self, 'job_id', job_id)
+
+    def __getattr__(self, name):
+        if name not in ConversionProgress.FIELDS and name != 'version':
+            raise AttributeError(name)
+        return self._store._read(self.job_id, name)
+
+    def __setattr__(self, name, value):
+        self.update(**{name: value})
+
+    def update(self, **fields):
+        self._store._write(self.job_id, fields)
+
+    def snapshot(self):
+        row = self._store._read(self.job_id, '*')
+        return {name: row[name] if name != 'job_id' else self.job_id for name in ConversionProgress.FIELDS}
+
+    def wait_for_change(self, version, timeout):
+        # Other processes write the row, so poll the version column
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self.version
+            if current != version or time.monotonic() >= deadline:
+                return current
+            time.sleep(JOB_STORE_POLL_INTERVAL)
+
+class SQLiteJobStore:
+    """Job store in a WAL-mode SQLite database shared by every process on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        columns = ', '.join(name for name in ConversionProgress.FIELDS if name != 'job_id')
+        with self._connection() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, "
+                         f"version INTEGER NOT NULL DEFAULT 0, {columns})")
+            conn.execute("CREATE TABLE IF NOT EXISTS conversions "
+                         "(conversion_id TEXT PRIMARY KEY, job_id TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS conversions_job_id ON conversions (job_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS batches (batch_id TEXT PRIMARY KEY, record TEXT NOT NULL)")
+            # Add columns for fields introduced after the database was created
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name in ConversionProgress.FIELDS:
+                if name != 'job_id' and name not in existing:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name}")
+
+    def _connection(self):
+        # One connection per thread, reopened after a gunicorn fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _read(self, job_id, column):
+        row = self._connection().execute(f"SELECT {column} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            raise KeyError(job_id)
+        if column == '*':
+            return {key: self._decode(key, row[key]) for key in row.keys()}
+        return self._decode(column, row[0])
+
+    @staticmethod
+    def _encode(name, value):
+        return json.dumps(value) if name in ConversionProgress.JSON_FIELDS else value
+
+    @staticmethod
+    def _decode(name, value):
+        if name in ConversionProgress.JSON_FIELDS and value is not None:
+            return json.loads(value)
+        return value
+
+    def _write(self, job_id, fields):
+        unknown = set(fields) - set(ConversionProgress.FIELDS)
+        if unknown or 'job_id' in fields:
+            raise AttributeError(f"Cannot store fields: {sorted(unknown) or ['job_id']}")
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        if any(name in ConversionProgress.WATCHED_FIELDS for name in fields):
+            assignments += ", version = version + 1"
+        with self._connection() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?",
+                         (*(self._encode(name, value) for name, value in fields.items()), job_id))
+
+    def create(self, conversion_id):
+        defaults = ConversionProgress().snapshot()
+        defaults.pop('job_id')
+        names = ', '.join(defaults)
+        placeholders = ', '.join('?' for _ in defaults)
+        with self._connection() as conn:
+            conn.execute(f"INSERT INTO jobs (job_id, {names}) VALUES (?, {placeholders})",
+                         (conversion_id, *(self._encode(name, value) for name, value in defaults.items())))
+            conn.execute("INSERT INTO conversions (conversion_id, job_id) VALUES (?, ?)",
+                         (conversion_id, conversion_id))
+        return SQLiteConversionProgress(self, conversion_id)
+
+    def alias(self, conversion_id, leader_id):
+        job_id = self._job_id(leader_id)
+        if job_id is None:
+            raise KeyError(leader_id)
+        with self._connection() as conn:
+            conn.execute("INSERT INTO conversions (conversion_id, job_id) VALUES (?, ?)",
+                         (conversion_id, job_id))
+
+    def _job_id(self, conversion_id):
+        row = self._connection().execute(
+            "SELECT job_id FROM conversions WHERE conversion_id = ?", (conversion_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def get(self, conversion_id):
+        job_id = self._job_id(conversion_id)
+        return SQLiteConversionProgress(self, job_id) if job_id else None
+
+    def __getitem__(self, conversion_id):
+        progress = self.get(conversion_id)
+        if progress is None:
+            raise KeyError(conversion_id)
+        return progress
+
+    def __contains__(self, conversion_id):
+        return self._job_id(conversion_id) is not None
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM conversions").fetchone()[0]
+
+    def conversion_ids(self, conversion_id):
+        """Every conversion ID sharing this conversion's job"""
+        rows = self._connection().execute(
+            "SELECT conversion_id FROM conversions WHERE job_id = "
+            "(SELECT job_id FROM conversions WHERE conversion_id = ?)", (conversion_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def jobs(self):
+        """List of (progress, conversion_ids) with aliases grouped per job"""
+        rows = self._connection().execute(
+            "SELECT job_id, group_concat(conversion_id) FROM conversions GROUP BY job_id"
+        ).fetchall()
+        return [(SQLiteConversionProgress(self, job_id), ids.split(',')) for job_id, ids in rows]
+
+    def remove(self, conversion_ids):
+        conversion_ids = list(conversion_ids)
+        placeholders = ', '.join('?' for _ in conversion_ids)
+        with self._connection() as conn:
+            conn.execute(f"DELETE FROM conversions WHERE conversion_id IN ({placeholders})", conversion_ids)
+            conn.execute("DELETE FROM jobs WHERE job_id NOT IN (SELECT job_id FROM conversions)")
+
+    def save_batch(self, batch_id, record):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO batches (batch_id, record) VALUES (?, ?)",
+                         (batch_id, json.dumps(record)))
+
+    def get_batch(self, batch_id):
+        row = self._connection().execute(
+            "SELECT record FROM batches WHERE batch_id = ?", (batch_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def batch_ids(self):
+        return [row[0] for row in self._connection().execute("SELECT batch_id FROM batches")]
+
+    def remove_batch(self, batch_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM batches WHERE batch_id = ?", (batch_id,))
+
+def create_job_store(kind):
+    if kind == 'sqlite':
+        print(f"🗄️ Using SQLite job store at {JOB_STORE_PATH}")
+        return SQLiteJobStore(JOB_STORE_PATH)
+    return InMemoryJobStore()
+
+def new_conversion_id():
+    """Collision-free conversion ID (still sortable by start time)"""
+    return f"conv_{int(time.time())}_{uuid.uuid4().hex[:12]}"
+
+# Global store of conversion progress
+conversion_status = create_job_store(JOB_STORE)
+
+class Metrics:
+    """Minimal in-process Prometheus registry: counters, histograms and callback gauges"""
+
+    DURATION_BUCKETS = (0.005, 0.05, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+    BYTE_BUCKETS = tuple(2 ** power for power in range(20, 33))  # 1 MiB .. 4 GiB
+    RATE_BUCKETS = tuple(2 ** power for power in range(16, 31))  # 64 KiB/s .. 1 GiB/s
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def counter(self, name, help_text):
+        self._meta[name] = ('counter', help_text, None)
+
+    def histogram(self, name, help_text, buckets=DURATION_BUCKETS):
+        self._meta[name] = ('histogram', help_text, buckets)
+
+    def gauge(self, name, help_text, callback):
+        """callback returns a number, or a dict of {labels-dict-as-tuple: number}"""
+        self._meta[name] = ('gauge', help_text, None)
+        self._gauges[name] = callback
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self._meta[name][2]
+        with self._lock:
+            series = self._histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{str(value)}"' for key, value in pairs) + '}'
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(series[0]), series[1], series[2]) for key, series in self._histograms.items()}
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                for (metric, labels), value in counters.items():
+                    if metric == name:
+                        lines.append(f"{name}{self._labels(labels)} {value}")
+            elif kind == 'histogram':
+                for (metric, labels), (counts, total, count) in histograms.items():
+                    if metric != name:
+                        continue
+                    for bound, bucket_count in zip(buckets, counts):
+                        lines.append(f"{name}_bucket{self._labels(labels + (('le', bound),))} {bucket_count}")
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {total}")
+                    lines.append(f"{name}_count{self._labels(labels)} {count}")
+            else:
+                try:
+                    values = self._gauges[name]()
+                except Exception as e:
+                    print(f"⚠️ Metric {name} failed: {str(e)}")
+                    continue
+                if not isinstance(values, dict):
+                    values = {(): values}
+                for labels, value in values.items():
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.histogram('ytc_stage_duration_seconds', 'Time spent in each pipeline stage')
+metrics.histogram('ytc_download_bytes', 'Size of downloaded media files', Metrics.BYTE_BUCKETS)
+metrics.histogram('ytc_output_bytes', 'Size of finished conversion outputs', Metrics.BYTE_BUCKETS)
+metrics.histogram('ytc_download_throughput_bytes_per_second', 'Media transfer rate of yt-dlp downloads',
+                  Metrics.RATE_BUCKETS)
+metrics.counter('ytc_extractor_attempts_total', 'Extraction/download attempts per player client and result')
+metrics.counter('ytc_conversions_total', 'Finished conversions by outcome')
+metrics.counter('ytc_http_rejections_total', 'Conversions rejected because the queue was full')
+
+@contextmanager
+def timed_stage(stage, conversion_id=None):
+    """Record a stage duration in the histogram and, if given, on the job itself"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('ytc_stage_duration_seconds', elapsed, stage=stage)
+        if conversion_id:
+            record_job_timing(conversion_id, stage, elapsed)
+
+class TransferTimer:
+    """yt-dlp progress hook timing each file from its first 'downloading' report to 'finished'"""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.bytes = 0
+        self._started = {}
+
+    def hook(self, d):
+        if d['status'] == 'downloading':
+            self._started.setdefault(d.get('filename'), time.perf_counter())
+        elif d['status'] == 'finished' and d.get('filename') in self._started:
+            self.seconds += time.perf_counter() - self._started.pop(d.get('filename'))
+            self.bytes += d.get('total_bytes') or d.get('downloaded_bytes') or 0
+
+    def close(self):
+        """Count transfers cut short by an error or cancellation up to now"""
+        now = time.perf_counter()
+        self.seconds += sum(now - started for started in self._started.values())
+        self._started.clear()
+
+@contextmanager
+def timed_download(transfer, conversion_id=None):
+    """Split a yt-dlp call into 'download' (the transfer) and 'extraction' (everything else)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        # Throughput only covers files that finished
+        if transfer.seconds > 0 and transfer.bytes:
+            metrics.observe('ytc_download_throughput_bytes_per_second', transfer.bytes / transfer.seconds)
+        transfer.close()
+        elapsed = time.perf_counter() - started
+        for stage, seconds in (('download', transfer.seconds), ('extraction', max(elapsed - transfer.seconds, 0))):
+            metrics.observe('ytc_stage_duration_seconds', seconds, stage=stage)
+            if conversion_id:
+                record_job_timing(conversion_id, stage, seconds)
+
+def record_job_timing(conversion_id, stage, seconds):
+    """Accumulate per-job stage timings reported by /api/status"""
+    status = conversion_status.get(conversion_id)
+    if status is not None:
+        timings = dict(status.timings or {})
+        timings[stage] = round(timings.get(stage, 0) + seconds, 3)
+        status.timings = timings
+
+def record_extractor_attempt(name, success, client=None, latency=None):
+    """Count an extraction attempt and feed the player-client scoreboard"""
+    metrics.inc('ytc_extractor_attempts_total', client=name, result='success' if success else 'failure')
+    if client:
+        extractor_scoreboard.record(client, success, latency)
+
+class QueueFullError(Exception):
+    """Raised when the pending conversion queue is at capacity"""
+
+class ConversionCancelled(Exception):
+    """Raised inside a worker once its job has been cancelled"""
+
+def token_client_id(token):
+    # Hashed so client IDs can be stored and logged without leaking tokens
+    return 'token:' + hashlib.sha256(token.encode()).hexdigest()[:12]
+
+def parse_client_weights(spec):
+    """Parse "token=weight,token" into {client_id: weight}"""
+    weights = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        token, _, weight = entry.partition('=')
+        weights[token_client_id(token.strip())] = float(weight) if weight else 1.0
+    return weights
+
+CLIENT_WEIGHTS = parse_client_weights(API_TOKENS)
+
+def request_client_id():
+    """Identify the caller for fair-share scheduling: known API token, else IP"""
+    token = request.headers.get('X-API-Token')
+    if token and token_client_id(token) in CLIENT_WEIGHTS:
+        return token_client_id(token)
+    forwarded = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+    if TRUSTED_PROXY_HOPS and len(forwarded) >= TRUSTED_PROXY_HOPS:
+        return 'ip:' + forwarded[-TRUSTED_PROXY_HOPS]
+    return 'ip:' + (request.remote_addr or 'unknown')
+
+class ConversionScheduler:
+    """Fixed-size worker pool shared fairly between clients
+
+    Pending jobs are ordered by self-clocked fair queueing: each job gets a
+    virtual finish tag of max(virtual time, client's previous tag) + cost /
+    weight, and workers take the lowest tag. A client submitting many long
+    jobs therefore only delays its own queue, and short jobs from other
+    clients overtake long ones. Client and cost are read from the job.
+
+    Each pipeline stage has its own scheduler. Jobs are tagged with
+    ``queued_<name>`` while waiting and ``<name>`` while running, and the
+    time spent in the queue is recorded in the job's ``<name>_wait`` field.
+    A ``max_pending`` of None leaves the queue unbounded; the per-client
+    limits are off when None or 0.
+    """
+
+    def __init__(self, name, max_workers, max_pending=None, max_client_pending=None,
+                 max_client_active=None, weights=None):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_client_pending = max_client_pending
+        self.max_client_active = max_client_active
+        self.weights = weights or {}
+        self.active = 0
+        self._pending = []  # sorted (finish_tag, seq, conversion_id, func, args, enqueued_at, client)
+        self._seq = 0
+        self._virtual_time = 0.0
+        self._client_tags = {}
+        self._client_active = {}
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def submit(self, conversion_id, func, *args):
+        """Queue a job and return its 1-based queue position"""
+        status = conversion_status[conversion_id]
+        client = status.client or 'anonymous'
+        cost = status.cost or DEFAULT_JOB_COST
+        with self._cond:
+            if self.max_pending is not None and len(self._pending) >= self.max_pending:
+                raise QueueFullError(f"Conversion queue is full ({self.max_pending} pending)")
+            if self.max_client_pending and \
+                    sum(1 for entry in self._pending if entry[6] == client) >= self.max_client_pending:
+                raise QueueFullError(f"{client} already has {self.max_client_pending} conversions queued")
+            finish_tag = max(self._virtual_time, self._client_tags.get(client, 0.0)) \
+                + cost / self.weights.get(client, 1.0)
+            self._client_tags[client] = finish_tag
+            self._seq += 1
+            entry = (finish_tag, self._seq, conversion_id, func, args, time.monotonic(), client)
+            bisect.insort(self._pending, entry)
+            status.stage = f"queued_{self.name}"
+            self._publish_positions()
+            self._start_workers()
+            self._cond.notify()
+            return self._pending.index(entry) + 1
+
+    def cancel(self, conversion_id):
+        """Drop a job that has not started yet; returns its args or None"""
+        with self._cond:
+            for entry in self._pending:
+                if entry[2] == conversion_id:
+                    self._pending.remove(entry)
+                    self._publish_positions()
+                    return entry[4]
+        return None
+
+    def _publish_positions(self):
+        # Stored on the job so any process (and SSE listeners) can report it
+        for index, entry in enumerate(self._pending):
+            status = conversion_status.get(entry[2])
+            if status is not None and status.queue_position != index + 1:
+                status.queue_position = index + 1
+
+    def _next_entry(self):
+        """Lowest finish tag among clients under their in-flight limit"""
+        for entry in self._pending:
+            if not self.max_client_active or self._client_active.get(entry[6], 0) < self.max_client_active:
+                return entry
+        return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.max_workers,
+                'active': self.active,
+                'pending': len(self._pending),
+                'max_pending': self.max_pending,
+                'clients_waiting': len({entry[6] for entry in self._pending}),
+                'clients_active': sum(1 for count in self._client_active.values() if count),
+                'max_client_pending': self.max_client_pending,
+                'max_client_active': self.max_client_active,
+            }
+
+    def _start_workers(self):
+        # Threads are started lazily so forked gunicorn workers get their own pool
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.max_workers:
+            thread = threading.Thread(target=self._worker_loop, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                entry = self._next_entry()
+                while entry is None:
+                    self._cond.wait()
+                    entry = self._next_entry()
+                self._pending.remove(entry)
+                finish_tag, _, conversion_id, func, args, enqueued_at, client = entry
+                self._virtual_time = max(self._virtual_time, finish_tag)
+                if self._client_tags.get(client, 0.0) <= self._virtual_time:
+                    self._client_tags.pop(client, None)  # Nothing newer queued; virtual time covers it
+                self._client_active[client] = self._client_active.get(client, 0) + 1
+                self.active += 1
+                self._publish_positions()
+            waited = time.monotonic() - enqueued_at
+            metrics.observe('ytc_stage_duration_seconds', waited, stage=f"queue_{self.name}")
+            status = conversion_status.get(conversion_id)
+            if status is not None:
+                status.update(**{
+                    'stage': self.name,
+                    'queue_position': None,
+                    f"{self.name}_wait": round(waited, 3),
+                })
+            try:
+                func(conversion_id, *args)
+            except Exception as e:
+                print(f"❌ Worker error for {conversion_id}: {str(e)}")
+            finally:
+                with self._cond:
+                    self.active -= 1
+                    self._client_active[client] -= 1
+                    if not self._client_active[client]:
+                        del self._client_active[client]
+                    # A client under its limit again may unblock a waiting worker
+                    self._cond.notify_all()
+
+scheduler = ConversionScheduler(
+    'download', MAX_CONVERSION_WORKERS, MAX_PENDING_CONVERSIONS,
+    max_client_pending=MAX_CLIENT_PENDING_CONVERSIONS,
+    max_client_active=MAX_CLIENT_ACTIVE_CONVERSIONS,
+    weights=CLIENT_WEIGHTS,
+)
+postprocess_scheduler = ConversionScheduler('postprocess', MAX_POSTPROCESS_WORKERS, weights=CLIENT_WEIGHTS)
+
+class VideoInfoCache:
+    """Thread-safe TTL + LRU cache of extracted info dicts keyed by video ID"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, video_id):
+        """Return (info, method) for a fresh entry, or None"""
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[video_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    # Large parts of a YouTube info dict that neither /api/video-info nor the
+    # download from cached info use (captions alone run to hundreds of KB)
+    UNUSED_KEYS = ('automatic_captions', 'subtitles', 'thumbnails', 'heatmap', 'chapters',
+                   'requested_formats', 'requested_subtitles', 'description')
+
+    @classmethod
+    def trim(cls, info):
+        """Shallow copy of an info dict without the bulky unused keys and storyboard formats"""
+        trimmed = {key: value for key, value in info.items() if key not in cls.UNUSED_KEYS}
+        if info.get('formats'):
+            trimmed['formats'] = [f for f in info['formats'] if f.get('ext') != 'mhtml']
+        return trimmed
+
+    def put(self, video_id, info, method):
+        if self.max_entries <= 0:
+            return
+        info = self.trim(info)
+        with self._lock:
+            self._entries[video_id] = (time.monotonic(), info, method)
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+video_info_cache = VideoInfoCache(VIDEO_INFO_CACHE_TTL, VIDEO_INFO_CACHE_SIZE)
+
+class ExtractorScoreboard:
+    """Per player-client success rate and latency over a sliding window
+
+    Clients are ordered by expected time-to-success, (delay + latency) / p,
+    with Laplace-smoothed success probability so untried clients still get
+    a turn. Unscored clients keep their listed order.
+    """
+
+    DEFAULT_LATENCY = 5.0
+
+    def __init__(self, window_size, window_seconds, failure_threshold, cooldown):
+        self.window_seconds = window_seconds
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._window_size = window_size
+        self._attempts = {}
+        self._streaks = {}
+        self._cooldown_until = {}
+        self._lock = threading.Lock()
+
+    def record(self, client, success, latency=None):
+        """Log an attempt; latency is None when it is not comparable (e.g. a full download)"""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._attempts.setdefault(client, deque(maxlen=self._window_size))
+            attempts.append((now, success, latency))
+            if success:
+                self._streaks[client] = 0
+                self._cooldown_until.pop(client, None)
+                return
+            self._streaks[client] = self._streaks.get(client, 0) + 1
+            if self._streaks[client] >= self.failure_threshold:
+                self._cooldown_until[client] = now + self.cooldown
+                print(f"🧊 Cooling down {client} client for {self.cooldown}s after {self._streaks[client]} failures")
+
+    def _score(self, client, delay, now):
+        attempts = [a for a in self._attempts.get(client, ()) if now - a[0] <= self.window_seconds]
+        successes = sum(1 for a in attempts if a[1])
+        latencies = [a[2] for a in attempts if a[2] is not None]
+        probability = (successes + 1) / (len(attempts) + 2)
+        latency = sum(latencies) / len(latencies) if latencies else self.DEFAULT_LATENCY
+        return attempts, probability, latency, (delay + latency) / probability
+
+    def order(self, extractors, delay=0.0, key=lambda extractor: extractor['client']):
+        """Sort extractors by expected time-to-success, dropping clients in cool-down"""
+        now = time.monotonic()
+        with self._lock:
+            expected = {key(e): self._score(key(e), delay, now)[3] for e in extractors}
+            cooling = {key(e): self._cooldown_until.get(key(e), 0) for e in extractors}
+        ranked = sorted(extractors, key=lambda e: expected[key(e)])
+        available = [e for e in ranked if cooling[key(e)] <= now]
+        if available:
+            return available
+        # Everything is cooling down: try whichever recovers first rather than nothing
+        return sorted(extractors, key=lambda e: cooling[key(e)])
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            clients = {}
+            for client in self._attempts:
+                attempts, probability, latency, expected = self._score(client, 0.0, now)
+                remaining = self._cooldown_until.get(client, 0) - now
+                clients[client] = {
+                    'attempts': len(attempts),
+                    'success_rate': round(sum(1 for a in attempts if a[1]) / len(attempts), 3) if attempts else None,
+                    'avg_latency': round(latency, 3),
+                    'expected_time_to_success': round(expected, 3),
+                    'consecutive_failures': self._streaks.get(client, 0),
+                    'cooldown_remaining': round(remaining, 1) if remaining > 0 else 0,
+                }
+        return {
+            'window_seconds': self.window_seconds,
+            'failure_threshold': self.failure_threshold,
+            'cooldown': self.cooldown,
+            'clients': clients,
+        }
+
+extractor_scoreboard = ExtractorScoreboard(
+    EXTRACTOR_WINDOW_SIZE, EXTRACTOR_WINDOW_SECONDS, EXTRACTOR_FAILURE_THRESHOLD, EXTRACTOR_COOLDOWN
+)
+
+class ArtifactStore:
+    """On-disk LRU store of finished conversions keyed by (video ID, format, quality)
+
+    Each artifact lives in its own ``<root>/<key>/`` directory. Entries are
+    published with an atomic directory rename so concurrent writers (threads
+    or gunicorn workers) never expose a partial file, and the directory mtime
+    is bumped on every hit and download to drive LRU eviction. Entries that
+    a live job still points at (as reported by ``in_use``) are never evicted;
+    the janitor reaps the oldest finished jobs when that leaves the store
+    over budget.
+    """
+
+    def __init__(self, root, max_bytes, in_use=None):
+        self.max_bytes = max_bytes
+        self.in_use = in_use or (lambda: ())
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(video_id, format_type, quality):
+        return hashlib.sha256(f"{video_id}:{format_type}:{quality}".encode()).hexdigest()[:32]
+
+    def get(self, video_id, format_type, quality):
+        """Return the path of a stored artifact, or None"""
+        entry_dir = os.path.join(self.root, self.key(video_id, format_type, quality))
+        try:
+            files = os.listdir(entry_dir)
+            path = os.path.join(entry_dir, files[0])
+            os.utime(entry_dir)
+        except (OSError, IndexError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def entry_of(self, path):
+        """Return the entry directory holding path, or None for files outside the store"""
+        if not path:
+            return None
+        entry_dir = os.path.dirname(os.path.abspath(path))
+        return entry_dir if os.path.dirname(entry_dir) == self.root else None
+
+    def touch(self, path):
+        """Mark the artifact holding path as used; no-op for files outside the store"""
+        entry_dir = self.entry_of(path)
+        if entry_dir:
+            try:
+                os.utime(entry_dir)
+            except OSError:
+                pass
+
+    def put(self, video_id, format_type, quality, file_path):
+        """Move a finished file into the store and return its new path"""
+        size = os.path.getsize(file_path)
+        if size > self.max_bytes:
+            return None
+        key = self.key(video_id, format_type, quality)
+        entry_dir = os.path.join(self.root, key)
+        staging_dir = tempfile.mkdtemp(prefix=f".{key}-", dir=self.root)
+        staged_path = os.path.join(staging_dir, os.path.basename(file_path))
+        shutil.move(file_path, staged_path)
+        try:
+            os.rename(staging_dir, entry_dir)
+        except OSError:
+            # Another job published the same artifact first; keep theirs
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return self.get(video_id, format_type, quality)
+        # The publishing job does not point at its entry yet
+        self.evict(keep=entry_dir)
+        return os.path.join(entry_dir, os.path.basename(file_path))
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, name)
+            if name.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+                entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self, keep=None):
+        """Drop least recently used artifacts no job points at until the store fits its budget
+
+        Returns the number of bytes freed.
+        """
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                return 0
+            pinned = {self.entry_of(path) for path in self.in_use()}
+            pinned.add(keep)
+            freed = 0
+            for _, size, entry_dir in entries:
+                if total <= self.max_bytes:
+                    break
+                if entry_dir in pinned:
+                    continue
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total -= size
+                freed += size
+                print(f"🧹 Evicted cached artifact {os.path.basename(entry_dir)} ({size / 1024 / 1024:.1f}MB)")
+            if total > self.max_bytes:
+                print(f"⚠️ Output cache over budget by {(total - self.max_bytes) / 1024 / 1024:.1f}MB; "
+                      f"remaining artifacts are in use")
+            return freed
+
+    def over_budget(self):
+        return sum(size for _, size, _ in self._entries()) > self.max_bytes
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            return {
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+def live_artifact_paths():
+    """Files that jobs still in the job store may serve"""
+    return [status.file_path for status, _ in conversion_status.jobs() if status.file_path]
+
+artifact_store = ArtifactStore(OUTPUT_CACHE_DIR, OUTPUT_CACHE_MAX_BYTES, in_use=live_artifact_paths)
+
+class InFlightConversions:
+    """Single-flight registry mapping a job key to the conversion doing the work"""
+
+    def __init__(self):
+        self.coalesced = 0
+        self._leaders = {}
+        self._lock = threading.Lock()
+
+    def attach(self, job_key, conversion_id):
+        """Register conversion_id as leader, or return the existing leader's ID"""
+        with self._lock:
+            leader_id = self._leaders.get(job_key)
+            if leader_id is not None:
+                self.coalesced += 1
+                return leader_id
+            self._leaders[job_key] = conversion_id
+            return None
+
+    def release(self, job_key):
+        with self._lock:
+            self._leaders.pop(job_key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._leaders), 'coalesced': self.coalesced}
+
+in_flight = InFlightConversions()
+
+def directory_size(path):
+    """Total size in bytes of the files below path"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+    return total
+
+class Janitor:
+    """Background reaper for finished jobs, their scratch directories and status entries"""
+
+    def __init__(self, interval, completed_ttl, failed_ttl, undownloaded_ttl, disk_quota):
+        self.interval = interval
+        self.completed_ttl = completed_ttl
+        self.failed_ttl = failed_ttl
+        self.undownloaded_ttl = undownloaded_ttl
+        self.disk_quota = disk_quota
+        self.reaped_jobs = 0
+        self.reclaimed_bytes = 0
+        self.last_run = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # Started lazily so each forked gunicorn worker runs its own janitor
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️ Janitor sweep failed: {str(e)}")
+
+    def _expired(self, status, now):
+        if status.finished_at is None:
+            return False
+        if status.error:
+            return now - status.finished_at > self.failed_ttl
+        if status.downloaded_at is None:
+            return now - status.finished_at > self.undownloaded_ttl
+        return now - status.downloaded_at > self.completed_ttl
+
+    def _reap(self, status, conversion_ids):
+        reclaimed = 0
+        if status.temp_dir and os.path.isdir(status.temp_dir):
+            reclaimed = directory_size(status.temp_dir)
+            shutil.rmtree(status.temp_dir, ignore_errors=True)
+        conversion_status.remove(conversion_ids)
+        return reclaimed
+
+    def sweep(self):
+        """Reap expired jobs, then the oldest finished jobs while over the disk quota or cache budget"""
+        now = time.time()
+        reaped = 0
+        reclaimed = 0
+        remaining = []
+        # Coalesced conversion IDs are grouped under the job doing the work
+        for status, conversion_ids in conversion_status.jobs():
+            if status.finished_at is None and not status.cancelled and status.last_seen is not None \
+                    and now - status.last_seen > ABANDONED_JOB_TIMEOUT:
+                print(f"🪦 Cancelling abandoned conversion {status.job_id}")
+                cancel_job(status.job_id)
+                continue
+            if self._expired(status, now):
+                reclaimed += self._reap(status, conversion_ids)
+                reaped += len(conversion_ids)
+            elif status.finished_at is not None:
+                remaining.append((status.finished_at, status, conversion_ids))
+        
+        remaining.sort(key=lambda job: job[0])
+        scratch_bytes = directory_size(SCRATCH_DIR)
+        while remaining and scratch_bytes > self.disk_quota:
+            _, status, conversion_ids = remaining.pop(0)
+            freed = self._reap(status, conversion_ids)
+            scratch_bytes -= freed
+            reclaimed += freed
+            reaped += len(conversion_ids)
+        
+        # Finished outputs live in the output cache, pinned by the jobs serving them
+        for _, status, conversion_ids in remaining:
+            if not artifact_store.over_budget():
+                break
+            if not artifact_store.entry_of(status.file_path):
+                continue
+            reclaimed += self._reap(status, conversion_ids)
+            reclaimed += artifact_store.evict()
+            reaped += len(conversion_ids)
+        
+        # Forget finished batches once all of their conversions have been reaped
+        for batch_id in conversion_status.batch_ids():
+            batch = ConversionBatch.load(batch_id)
+            if batch is None:
+                continue
+            live = [item for item in batch.items
+                    if item['conversion_id'] and item['conversion_id'] in conversion_status]
+            if not live and now - batch.created_at > self.failed_ttl \
+                    and all(batch._finished(item) for item in batch.items):
+                conversion_status.remove_batch(batch_id)
+        
+        with self._lock:
+            self.reaped_jobs += reaped
+            self.reclaimed_bytes += reclaimed
+            self.last_run = now
+        if reaped:
+            print(f"🧹 Janitor reaped {reaped} conversions, reclaimed {reclaimed / 1024 / 1024:.1f}MB")
+        return {'reaped_jobs': reaped, 'reclaimed_bytes': reclaimed, 'scratch_bytes': scratch_bytes}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'reaped_jobs': self.reaped_jobs,
+                'reclaimed_bytes': self.reclaimed_bytes,
+                'last_run': self.last_run,
+                'scratch_bytes': directory_size(SCRATCH_DIR),
+                'scratch_quota': self.disk_quota,
+            }
+
+janitor = Janitor(JANITOR_INTERVAL, COMPLETED_JOB_TTL, FAILED_JOB_TTL, UNDOWNLOADED_JOB_TTL, SCRATCH_DISK_QUOTA)
 
 def get_random_api_key():
     """Get random YouTube API key for rotation"""
@@ -36,8 +1222,9 @@ def get_random_api_key():
     ]
     return random.choice(api_keys)
 
+@functools.lru_cache(maxsize=None)
 def is_cloud_environment():
-    """Detect if running on cloud platform"""
+    """Detect if running on cloud platform (resolved once per process)"""
     cloud_indicators = [
         'RENDER',
         'HEROKU', 
@@ -53,47 +1240,50 @@ def is_cloud_environment():
 def progress_hook(d):
     """Progress hook for yt-dlp"""
     conversion_id = d.get('conversion_id')
-    if conversion_id and conversion_id in conversion_status:
+    status = conversion_status.get(conversion_id) if conversion_id else None
+    if status is not None:
+        # Raising here is how yt-dlp lets us abort a download mid-transfer
+        if status.cancelled:
+            raise ConversionCancelled(f"Conversion {conversion_id} cancelled")
         if d['status'] == 'downloading':
+            # A single progressive file can be piped to clients while it grows
+            if d.get('streamable') and d.get('tmpfilename') and status.stream_path is None \
+                    and not (d.get('info_dict') or {}).get('requested_formats'):
+                status.update(stream_path=d['tmpfilename'], stream_total_bytes=d.get('total_bytes'))
             if d.get('total_bytes'):
                 progress = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                conversion_status[conversion_id].progress = progress
-                conversion_status[conversion_id].status = f"Downloading... {progress:.1f}%"
+                status.update(progress=progress, status=f"Downloading... {progress:.1f}%")
         elif d['status'] == 'finished':
-            conversion_status[conversion_id].progress = 100
-            conversion_status[conversion_id].status = "Download complete"
-            conversion_status[conversion_id].file_path = d['filename']
+            status.update(progress=100, status="Download complete", file_path=d['filename'])
 
 def extract_video_id(url):
     """Extract YouTube video ID from URL"""
     parsed = urlparse(url)
     if parsed.hostname in ['www.youtube.com', 'youtube.com']:
         if parsed.path == '/watch':
-            return parse_qs(parsed.query)['v'][0]
+            return parse_qs(parsed.query).get('v', [None])[0]
         elif parsed.path.startswith('/embed/'):
             return parsed.path.split('/')[2]
     elif parsed.hostname in ['youtu.be']:
         return parsed.path[1:]
     return None
 
-def get_optimized_ydl_opts():
-    """Get optimized yt-dlp options for cloud deployment"""
-    
-    # Latest user agents from real browsers
-    user_agents = [
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
-    ]
-    
+# Latest user agents from real browsers
+USER_AGENTS = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1',
+)
+
+def build_ydl_opts_template():
+    """Static yt-dlp options for this process, frozen so jobs can only copy them"""
     is_cloud = is_cloud_environment()
     
     # Base options optimized for cloud
     opts = {
         # Enhanced headers to mimic real browser
-        'http_headers': {
-            'User-Agent': random.choice(user_agents),
+        'http_headers': MappingProxyType({
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.9,th;q=0.8',
             'Accept-Encoding': 'gzip, deflate, br',
@@ -106,40 +1296,33 @@ def get_optimized_ydl_opts():
             'Upgrade-Insecure-Requests': '1',
             'DNT': '1',
             'Connection': 'keep-alive',
-        },
+        }),
         
-        # Enhanced extractor arguments with API rotation
-        'extractor_args': {
-            'youtube': {
-                'player_client': ['ios', 'android', 'web', 'tv_embedded'],
-                'player_skip': ['configs', 'webpage'],
-                'skip': ['dash'],
-                'innertube_host': ['youtubei.googleapis.com'],
-                'innertube_key': [get_random_api_key()],  # Random API key rotation
-                'player_params': ['CgIQBg%3D%3D'],  # Age restriction bypass
-            }
-        },
+        # Enhanced extractor arguments; the API key is rotated per job
+        'extractor_args': MappingProxyType({
+            'youtube': MappingProxyType({
+                'player_client': ('ios', 'android', 'web', 'tv_embedded'),
+                'player_skip': ('configs', 'webpage'),
+                'skip': ('dash',),
+                'innertube_host': ('youtubei.googleapis.com',),
+                'player_params': ('CgIQBg%3D%3D',),  # Age restriction bypass
+            }),
+        }),
         
         # Network settings optimized for cloud
         'socket_timeout': 30 if is_cloud else 60,
         'retries': 5 if is_cloud else 12,
         'fragment_retries': 5 if is_cloud else 12,
-        'retry_sleep_functions': {
+        'retry_sleep_functions': MappingProxyType({
             'http': lambda n: min(2 ** n, 15),
             'fragment': lambda n: min(2 ** n, 15),
-        },
-        
-        # Shorter delays for cloud to avoid timeout
-        'sleep_interval': random.uniform(0.5, 1.5) if is_cloud else random.uniform(2, 4),
-        'max_sleep_interval': random.uniform(1.5, 3) if is_cloud else random.uniform(4, 8),
-        'sleep_interval_requests': random.uniform(0.3, 1) if is_cloud else random.uniform(1, 3),
+        }),
         
         # Enhanced bypass options
-        'format_sort': ['res:720', 'ext:mp4', 'codec'],
+        'format_sort': ('res:720', 'ext:mp4', 'codec'),
         'prefer_free_formats': True,
         'no_check_certificate': True,
         'geo_bypass': True,
-        'geo_bypass_country': random.choice(['US', 'CA', 'GB', 'AU']),
         
         # Output settings
         'quiet': True,
@@ -151,29 +1334,52 @@ def get_optimized_ydl_opts():
     
     # Only try cookies if NOT in cloud environment
     if not is_cloud:
-        try:
-            print("🍪 Local environment detected - attempting browser cookies...")
-            browsers = [
-                ('chrome', None, None, None),
-                ('firefox', None, None, None), 
-                ('edge', None, None, None),
-            ]
-            
-            for browser_config in browsers:
-                try:
-                    opts['cookiesfrombrowser'] = browser_config
-                    print(f"🍪 Successfully configured {browser_config[0]} cookies")
-                    break
-                except Exception as e:
-                    print(f"⚠️ {browser_config[0]} cookies failed: {str(e)}")
-                    continue
-        except Exception as e:
-            print(f"⚠️ Browser cookies error: {str(e)}")
+        print("🍪 Local environment detected - using chrome browser cookies")
+        opts['cookiesfrombrowser'] = ('chrome', None, None, None)
     else:
         print("☁️ Cloud environment detected - skipping browser cookies")
     
+    return MappingProxyType(opts)
+
+YDL_OPTS_TEMPLATE = build_ydl_opts_template()
+
+def get_optimized_ydl_opts():
+    """Get optimized yt-dlp options for cloud deployment
+
+    A cheap copy of YDL_OPTS_TEMPLATE: only the nested containers and the
+    per-job randomized values (user agent, API key, sleeps, geo) are new.
+    """
+    template = YDL_OPTS_TEMPLATE
+    is_cloud = is_cloud_environment()
+    
+    opts = dict(template)
+    opts['http_headers'] = {**template['http_headers'], 'User-Agent': random.choice(USER_AGENTS)}
+    opts['extractor_args'] = {'youtube': {
+        **{key: list(value) for key, value in template['extractor_args']['youtube'].items()},
+        'innertube_key': [get_random_api_key()],  # Random API key rotation
+    }}
+    opts['retry_sleep_functions'] = dict(template['retry_sleep_functions'])
+    opts['format_sort'] = list(template['format_sort'])
+    
+    # Shorter delays for cloud to avoid timeout
+    opts['sleep_interval'] = random.uniform(0.5, 1.5) if is_cloud else random.uniform(2, 4)
+    opts['max_sleep_interval'] = random.uniform(1.5, 3) if is_cloud else random.uniform(4, 8)
+    opts['sleep_interval_requests'] = random.uniform(0.3, 1) if is_cloud else random.uniform(1, 3)
+    opts['geo_bypass_country'] = random.choice(['US', 'CA', 'GB', 'AU'])
+    
     return opts
 
+def warm_up():
+    """Import yt-dlp and the YouTube extractor before the first request
+
+    Called from gunicorn.conf.py in the master process so every forked
+    worker inherits the loaded modules.
+    """
+    started = time.perf_counter()
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+        ydl.get_info_extractor('Youtube')
+    print(f"🔥 yt-dlp warmed up in {(time.perf_counter() - started) * 1000:.0f}ms")
+
 def try_fast_extractors(url):
     """Try different extraction methods optimized for cloud"""
     
@@ -183,6 +1389,7 @@ def try_fast_extractors(url):
         # Method 1: iOS client (highest success rate)
         {
             'name': 'iOS Fast',
+            'client': 'ios',
             'opts': {
                 'extractor_args': {
                     'youtube': {
@@ -197,7 +1404,8 @@ def try_fast_extractors(url):
         
         # Method 2: Android client
         {
-            'name': 'Android Fast', 
+            'name': 'Android Fast',
+            'client': 'android',
             'opts': {
                 'extractor_args': {
                     'youtube': {
@@ -212,6 +1420,7 @@ def try_fast_extractors(url):
         # Method 3: TV embedded (only if first two fail)
         {
             'name': 'TV Fast',
+            'client': 'tv_embedded',
             'opts': {
                 'extractor_args': {
                     'youtube': {
@@ -227,7 +1436,11 @@ def try_fast_extractors(url):
     # Limit attempts in cloud environment
     max_attempts = 2 if is_cloud else 3
     
+    # Best expected time-to-success first, skipping clients in cool-down
+    extractors = extractor_scoreboard.order(extractors, delay=1.5 if is_cloud else 3)
+    
     for i, extractor in enumerate(extractors[:max_attempts]):
+        started = time.monotonic()
         try:
             print(f"🔄 Trying {extractor['name']} ({i+1}/{max_attempts})...")
             
@@ -241,17 +1454,21 @@ def try_fast_extractors(url):
             # Shorter delay in cloud environment
             delay = random.uniform(1, 2) if is_cloud else random.uniform(2, 4)
             print(f"⏱️ Cloud-optimized delay: {delay:.1f}s...")
-            time.sleep(delay)
+            with timed_stage('extractor_delay'):
+                time.sleep(delay)
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            started = time.monotonic()
+            with timed_stage('extraction'), yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 info = ydl.extract_info(url, download=False)
                 
-                if info:
-                    api_key_short = ydl_opts['extractor_args']['youtube']['innertube_key'][0][:20]
-                    print(f"✅ Success with {extractor['name']} using API key: {api_key_short}...")
-                    return info, extractor['name']
+            record_extractor_attempt(extractor['name'], bool(info), extractor['client'], time.monotonic() - started)
+            if info:
+                api_key_short = ydl_opts['extractor_args']['youtube']['innertube_key'][0][:20]
+                print(f"✅ Success with {extractor['name']} using API key: {api_key_short}...")
+                return info, extractor['name']
                     
         except Exception as e:
+            record_extractor_attempt(extractor['name'], False, extractor['client'], time.monotonic() - started)
             print(f"❌ {extractor['name']} failed: {str(e)}")
             continue
     
@@ -271,11 +1488,20 @@ def get_video_info():
         if not video_id:
             return jsonify({'error': 'Invalid YouTube URL'}), 400
             
-        print(f"🔍 Getting info for video: {video_id}")
-        print(f"🔑 Using cloud-optimized extraction with API rotation")
-        
-        # Try fast extractors optimized for cloud
-        info, method = try_fast_extractors(url)
+        # Serve repeated lookups straight from the metadata cache
+        cached = video_info_cache.get(video_id)
+        if cached:
+            info, method = cached
+            print(f"⚡ Metadata cache hit for video: {video_id}")
+        else:
+            print(f"🔍 Getting info for video: {video_id}")
+            print(f"🔑 Using cloud-optimized extraction with API rotation")
+            
+            # Try fast extractors optimized for cloud
+            with timed_stage('video_info'):
+                info, method = try_fast_extractors(url)
+            if info:
+                video_info_cache.put(video_id, info, method)
         
         if info:
             return jsonify({
@@ -287,6 +1513,7 @@ def get_video_info():
                 'video_id': video_id,
                 'extraction_method': method,
                 'available_formats': len(info.get('formats', [])),
+                'cached': cached is not None,
                 'cloud_optimized': True,
                 'success': True
             })
@@ -313,37 +1540,367 @@ def convert_video():
         
         if not url:
             return jsonify({'error': 'URL is required'}), 400
-            
-        # Generate conversion ID
-        conversion_id = f"conv_{int(time.time())}"
-        conversion_status[conversion_id] = ConversionProgress()
-        
-        print(f"🚀 Starting cloud-optimized conversion: {format_type.upper()} @ {quality.upper()}")
-        print(f"📹 URL: {url}")
-        print(f"🛡️ Using API rotation + fast extraction")
-        
-        # Start conversion in background thread
-        thread = threading.Thread(
-            target=perform_conversion_fast,
-            args=(conversion_id, url, format_type, quality)
-        )
-        thread.start()
         
-        return jsonify({
-            'conversion_id': conversion_id,
-            'status': 'started',
-            'message': 'Cloud-optimized conversion started with API rotation',
-            'features': ['api_rotation', 'fast_extraction', 'cloud_optimized']
-        })
+        try:
+            return jsonify(start_conversion(url, format_type, quality, request_client_id()))
+        except QueueFullError:
+            metrics.inc('ytc_http_rejections_total')
+            response = jsonify({
+                'error': 'Server is busy, please retry later',
+                'retry_after': QUEUE_RETRY_AFTER,
+            })
+            response.headers['Retry-After'] = str(QUEUE_RETRY_AFTER)
+            return response, 429
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def perform_conversion_fast(conversion_id, url, format_type, quality):
-    """Perform conversion with cloud-optimized methods"""
+def start_conversion(url, format_type, quality, client=None):
+    """Create a conversion and queue it; raises QueueFullError when the queue is full
+
+    Returns the /api/convert response body.
+    """
+    # Reuse metadata from a preceding /api/video-info call when available
+    video_id = extract_video_id(url)
+    cached = video_info_cache.get(video_id) if video_id else None
+    
+    # Generate conversion ID
+    conversion_id = new_conversion_id()
+    
+    # Serve a previously converted artifact without touching the pipeline
+    artifact_path = artifact_store.get(video_id, format_type, quality) if video_id else None
+    if artifact_path:
+        conversion_status.create(conversion_id).update(
+            file_path=artifact_path,
+            progress=100,
+            status="Cloud conversion complete - served from cache",
+            stage='done',
+            finished_at=time.time(),
+        )
+        janitor.ensure_started()
+        print(f"⚡ Output cache hit for {video_id} ({format_type} @ {quality})")
+        return {
+            'conversion_id': conversion_id,
+            'status': 'completed',
+            'completed': True,
+            'file_available': True,
+            'cached': True,
+            'message': 'Conversion served from cache',
+            'features': ['api_rotation', 'fast_extraction', 'cloud_optimized']
+        }
+    
+    janitor.ensure_started()
+    # Duration from /api/video-info estimates the job's cost for fair-share scheduling
+    status = conversion_status.create(conversion_id)
+    status.update(
+        status="Queued for conversion...",
+        client=client,
+        cost=(cached[0].get('duration') if cached else None) or DEFAULT_JOB_COST,
+    )
+    
+    # Attach to an identical conversion that is already queued or running; the
+    # job exists before it is published so followers can always alias it
+    job_key = (video_id or url, format_type, quality)
+    leader_id = in_flight.attach(job_key, conversion_id)
+    if leader_id is not None:
+        conversion_status.remove([conversion_id])
+        conversion_status.alias(conversion_id, leader_id)
+        print(f"🔗 Coalesced {conversion_id} with in-flight {leader_id}")
+        return {
+            'conversion_id': conversion_id,
+            'status': 'queued',
+            'coalesced': True,
+            'queue_position': conversion_status[leader_id].queue_position,
+            'message': 'Attached to an identical conversion already in progress',
+            'features': ['api_rotation', 'fast_extraction', 'cloud_optimized']
+        }
+    
+    print(f"🚀 Starting cloud-optimized conversion: {format_type.upper()} @ {quality.upper()}")
+    print(f"📹 URL: {url}")
+    print(f"🛡️ Using API rotation + fast extraction")
+    
+    # Hand the job to the worker pool; reject fast when the queue is full
     try:
+        position = scheduler.submit(
+            conversion_id, run_conversion, job_key, url, format_type, quality,
+            cached[0] if cached else None,
+        )
+    except QueueFullError as e:
+        # Followers may already be attached, so end the job instead of dropping it
+        in_flight.release(job_key)
+        status.update(
+            error=str(e),
+            status=f"Conversion rejected: {str(e)}",
+            stage='failed',
+            finished_at=time.time(),
+        )
+        print(f"🚦 {str(e)} - rejecting {conversion_id}")
+        raise
+    
+    return {
+        'conversion_id': conversion_id,
+        'status': 'queued',
+        'queue_position': position,
+        'message': 'Cloud-optimized conversion started with API rotation',
+        'features': ['api_rotation', 'fast_extraction', 'cloud_optimized']
+    }
+
+def build_download_opts(conversion_id, temp_dir, format_type, format_selector, filename_template,
+                        player_client=None, transfer=None):
+    """Build yt-dlp download options for a conversion job"""
+    ydl_opts = get_optimized_ydl_opts()
+    ydl_opts.update({
+        'format': format_selector,
+        'outtmpl': os.path.join(temp_dir, filename_template),
+        'progress_hooks': [lambda d: progress_hook({
+            **d, 'conversion_id': conversion_id, 'streamable': format_type in STREAMABLE_FORMATS,
+        })] + ([transfer.hook] if transfer else []),
+    })
+    if player_client:
+        ydl_opts['extractor_args'] = {
+            'youtube': {
+                'player_client': player_client,
+                'innertube_key': [get_random_api_key()],  # Fresh API key
+                'player_params': ['CgIQBg%3D%3D'],
+            }
+        }
+    
+    # Format-specific settings; postprocessing runs later in its own stage
+    if format_type in AUDIO_FORMATS:
+        ydl_opts['format'] = audio_format_selector(AUDIO_FORMATS[format_type], AUDIO_TARGET_ABR)
+    
+    return ydl_opts
+
+# Audio outputs and the source codec that can be stream-copied into them
+# (None: always encoded)
+AUDIO_FORMATS = {'mp3': None, 'm4a': 'aac', 'opus': 'opus'}
+# Smallest source bitrate (kbps) the audio fast path accepts
+AUDIO_TARGET_ABR = int(os.environ.get('AUDIO_TARGET_ABR', 128))
+
+def audio_format_selector(preferred_codec, target_abr):
+    """yt-dlp format selector picking the cheapest audio-only stream for a job
+
+    Prefers audio-only formats in the codec the output can copy, and among
+    them the smallest one whose bitrate still meets target_abr.
+    """
+    def bitrate(fmt):
+        return fmt.get('abr') or fmt.get('tbr') or 0
+    
+    def size(fmt):
+        return fmt.get('filesize') or fmt.get('filesize_approx') or float('inf')
+    
+    def select(ctx):
+        formats = ctx['formats']
+        audio_only = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+        matching = [f for f in audio_only if normalize_codec(f.get('acodec')) == preferred_codec]
+        candidates = matching or audio_only
+        if not candidates:
+            # No audio-only stream: take the smallest muxed format that has audio
+            muxed = [f for f in formats if f.get('acodec') != 'none']
+            if muxed:
+                yield min(muxed, key=lambda f: (size(f), bitrate(f)))
+            return
+        
+        meeting = [f for f in candidates if bitrate(f) >= target_abr]
+        if meeting:
+            yield min(meeting, key=lambda f: (bitrate(f), size(f)))
+        else:
+            yield max(candidates, key=bitrate)
+    
+    return select
+
+# Codecs each container can hold as-is, so a stream copy is enough
+REMUX_COMPATIBLE_CODECS = {
+    'mkv': None,  # Matroska takes anything
+    'mov': {'video': {'h264', 'hevc', 'mpeg4'}, 'audio': {'aac', 'mp3', 'alac', 'ac3'}},
+    'avi': {'video': {'h264', 'mpeg4'}, 'audio': {'mp3', 'ac3'}},
+}
+
+def normalize_codec(codec):
+    """Map yt-dlp codec strings (e.g. 'avc1.64001F', 'mp4a.40.2') to ffmpeg names"""
+    codec = (codec or 'none').split('.')[0].lower()
+    return {
+        'avc1': 'h264', 'avc3': 'h264', 'h264': 'h264',
+        'hev1': 'hevc', 'hvc1': 'hevc', 'h265': 'hevc',
+        'vp09': 'vp9', 'vp9': 'vp9', 'vp8': 'vp8',
+        'av01': 'av1',
+        'mp4a': 'aac', 'aac': 'aac',
+        'mp4v': 'mpeg4',
+    }.get(codec, codec)
+
+def plan_postprocessing(format_type, info):
+    """Decide how to turn the downloaded file into the requested format
+
+    Returns (path, postprocessors) where path is 'copy' (already in the
+    target container), 'remux' (stream copy into a new container) or
+    'transcode' (ffmpeg re-encode).
+    """
+    info = info or {}
+    if info.get('ext') == format_type:
+        return 'copy', []
+    
+    if format_type in AUDIO_FORMATS:
+        # FFmpegExtractAudio stream-copies when the source codec already matches
+        acodec = normalize_codec(info.get('acodec'))
+        path = 'remux' if acodec == AUDIO_FORMATS[format_type] else 'transcode'
+        return path, [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': format_type,
+            'preferredquality': '192',
+        }]
+    if format_type not in REMUX_COMPATIBLE_CODECS:
+        return 'copy', []
+    
+    allowed = REMUX_COMPATIBLE_CODECS[format_type]
+    vcodec = normalize_codec(info.get('vcodec'))
+    acodec = normalize_codec(info.get('acodec'))
+    codecs_known = info.get('vcodec') is not None and info.get('acodec') is not None
+    if allowed is None or (codecs_known and vcodec in allowed['video'] | {'none'}
+                           and acodec in allowed['audio'] | {'none'}):
+        return 'remux', [{'key': 'FFmpegVideoRemuxer', 'preferedformat': format_type}]
+    
+    return 'transcode', [{'key': 'FFmpegVideoConvertor', 'preferedformat': format_type}]
+
+def run_postprocessors(file_path, postprocessors):
+    """Run yt-dlp postprocessor definitions on a file and return the output path"""
+    info = {'filepath': file_path, 'ext': os.path.splitext(file_path)[1][1:]}
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+        for definition in postprocessors:
+            options = dict(definition)
+            pp_class = yt_dlp.postprocessor.get_postprocessor(options.pop('key'))
+            info = ydl.run_pp(pp_class(ydl, **options), info)
+    return info['filepath']
+
+def stream_urls_fresh(info):
+    """Check that the signed stream URLs in an info dict have not expired yet"""
+    for fmt in info.get('formats') or []:
+        expire = parse_qs(urlparse(fmt.get('url') or '').query).get('expire')
+        if expire:
+            return int(expire[0]) - STREAM_URL_EXPIRY_MARGIN > time.time()
+    return bool(info.get('formats'))
+
+# Results of the format selection and download made during extraction; left
+# on the dict they override the job's own selector when it is reprocessed
+SELECTION_KEYS = ('requested_formats', 'requested_downloads', 'requested_subtitles', '_filename', 'filepath')
+
+def download_from_info(ydl_opts, info):
+    """Download straight from a previously extracted info dict"""
+    # process_ie_result mutates the dict, so keep the cached copy pristine
+    info = copy.deepcopy(info)
+    for key in SELECTION_KEYS:
+        info.pop(key, None)
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.process_ie_result(info, download=True)
+
+def list_output_files(temp_dir):
+    """Downloaded media files in a job directory"""
+    return [f for f in os.listdir(temp_dir) if not f.endswith(('.info.json', '.part', '.ytdl'))]
+
+def run_conversion(conversion_id, job_key, url, format_type, quality, info=None):
+    """Download stage worker: fetch the media, then finish or queue postprocessing"""
+    pending = None
+    try:
+        pending = perform_conversion_fast(conversion_id, url, format_type, quality, info)
+        if pending:
+            conversion_status[conversion_id].status = "Queued for postprocessing..."
+            postprocess_scheduler.submit(
+                conversion_id, run_postprocess, job_key, *pending, url, format_type, quality
+            )
+    finally:
+        if not pending:
+            finish_conversion(conversion_id, job_key)
+
+def run_postprocess(conversion_id, job_key, temp_dir, file_path, postprocessors, url, format_type, quality):
+    """Postprocess stage worker: run ffmpeg, then finish the job"""
+    try:
+        perform_postprocess(conversion_id, temp_dir, file_path, postprocessors, url, format_type, quality)
+    finally:
+        finish_conversion(conversion_id, job_key)
+
+def finish_conversion(conversion_id, job_key):
+    """Mark a job as ended and let new requests for this key start fresh"""
+    try:
+        status = conversion_status.get(conversion_id)
+        if status is None:
+            return
+        if status.cancelled:
+            # Partial downloads are useless; free the disk right away
+            if status.temp_dir:
+                shutil.rmtree(status.temp_dir, ignore_errors=True)
+            status.update(
+                stage='cancelled',
+                error="Conversion cancelled",
+                status="Conversion cancelled",
+                stream_path=None,
+                finished_at=time.time(),
+            )
+        else:
+            status.update(stage='failed' if status.error else 'done', finished_at=time.time())
+        metrics.inc('ytc_conversions_total', result=status.stage)
+    finally:
+        # A stuck single-flight entry would fail every later request for this key
+        in_flight.release(job_key)
+
+def fail_conversion(conversion_id, error):
+    if conversion_status[conversion_id].cancelled:
+        print(f"🛑 Conversion {conversion_id} stopped after cancellation")
+        return
+    conversion_status[conversion_id].update(
+        error=str(error),
+        status=f"Cloud conversion error: {str(error)}",
+    )
+    print(f"❌ Cloud conversion error: {str(error)}")
+
+def kill_job_processes(temp_dir):
+    """Kill ffmpeg (or any) child processes working on files in a job directory"""
+    if not temp_dir or not os.path.isdir('/proc'):
+        return 0
+    killed = 0
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode(errors='replace')
+            if temp_dir in cmdline and int(pid) != os.getpid():
+                os.kill(int(pid), signal.SIGKILL)
+                killed += 1
+        except (OSError, ValueError):
+            continue
+    return killed
+
+def cancel_job(job_id):
+    """Abort a job wherever it is: queued, downloading or postprocessing"""
+    status = conversion_status.get(job_id)
+    if status is None or status.finished_at is not None:
+        return False
+    status.update(cancelled=True, status="Cancelling...")
+    
+    # Still queued: drop it and finish here (args start with the job key)
+    for pool in (scheduler, postprocess_scheduler):
+        args = pool.cancel(job_id)
+        if args is not None:
+            finish_conversion(job_id, args[0])
+            return True
+    
+    # Running: progress_hook aborts downloads, ffmpeg has to be killed
+    killed = kill_job_processes(status.temp_dir)
+    if killed:
+        print(f"🔪 Killed {killed} process(es) for {job_id}")
+    return True
+
+def perform_conversion_fast(conversion_id, url, format_type, quality, info=None):
+    """Download stage of a conversion
+
+    Returns (temp_dir, file_path, postprocessors) when the file still needs
+    a transcode, otherwise completes (or fails) the job and returns None.
+    """
+    try:
+        if conversion_status[conversion_id].cancelled:
+            raise ConversionCancelled(f"Conversion {conversion_id} cancelled")
+        
         # Create temporary directory
-        temp_dir = tempfile.mkdtemp()
+        os.makedirs(SCRATCH_DIR, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix=f"{conversion_id}-", dir=SCRATCH_DIR)
+        conversion_status[conversion_id].temp_dir = temp_dir
         
         conversion_status[conversion_id].status = "Initializing cloud conversion..."
         
@@ -360,6 +1917,28 @@ def perform_conversion_fast(conversion_id, url, format_type, quality):
         quality_suffix = f"_{quality}" if quality != 'best' else "_best"
         filename_template = f'%(title)s{quality_suffix}.%(ext)s'
         
+        # Reuse the info dict from /api/video-info while its stream URLs are valid
+        downloaded = False
+        downloaded_info = None
+        if info and stream_urls_fresh(info):
+            try:
+                conversion_status[conversion_id].status = "Downloading from cached video info..."
+                print(f"♻️ Reusing extracted info for {info.get('id', url)}")
+                transfer = TransferTimer()
+                ydl_opts = build_download_opts(conversion_id, temp_dir, format_type, format_selector,
+                                               filename_template, transfer=transfer)
+                with timed_download(transfer, conversion_id):
+                    downloaded_info = download_from_info(ydl_opts, info)
+                downloaded = bool(list_output_files(temp_dir))
+                record_extractor_attempt('Cached Info', downloaded)
+            except Exception as e:
+                if conversion_status[conversion_id].cancelled:
+                    raise
+                record_extractor_attempt('Cached Info', False)
+                print(f"❌ Cached info download failed, re-extracting: {str(e)}")
+        elif info:
+            print("⌛ Cached stream URLs expired - re-extracting")
+        
         # Fast extraction methods for download
         is_cloud = is_cloud_environment()
         extractors = [
@@ -370,93 +1949,163 @@ def perform_conversion_fast(conversion_id, url, format_type, quality):
         # Limit to 2 attempts in cloud
         max_attempts = 2 if is_cloud else 3
         
+        # Best expected time-to-success first, skipping clients in cool-down
+        extractors = extractor_scoreboard.order(
+            extractors, delay=1.5 if is_cloud else 4, key=lambda extractor: extractor['client'][0]
+        )
+        
         for i, extractor in enumerate(extractors[:max_attempts]):
+            if downloaded:
+                break
+            started = time.monotonic()
             try:
                 conversion_status[conversion_id].status = f"Trying {extractor['name']} extraction..."
                 print(f"🔄 Download attempt {i+1}/{max_attempts} with {extractor['name']} client")
                 
                 # Build optimized yt-dlp options
-                ydl_opts = get_optimized_ydl_opts()
-                ydl_opts.update({
-                    'format': format_selector,
-                    'outtmpl': os.path.join(temp_dir, filename_template),
-                    'progress_hooks': [lambda d: progress_hook({**d, 'conversion_id': conversion_id})],
-                    'extractor_args': {
-                        'youtube': {
-                            'player_client': extractor['client'],
-                            'innertube_key': [get_random_api_key()],  # Fresh API key
-                            'player_params': ['CgIQBg%3D%3D'],
-                        }
-                    }
-                })
-                
-                # Format-specific settings
-                if format_type == 'mp3':
-                    ydl_opts.update({
-                        'format': 'bestaudio/best',
-                        'postprocessors': [{
-                            'key': 'FFmpegExtractAudio',
-                            'preferredcodec': 'mp3',
-                            'preferredquality': '192',
-                        }],
-                    })
-                elif format_type in ['mov', 'avi', 'mkv']:
-                    ydl_opts['postprocessors'] = [{
-                        'key': 'FFmpegVideoConvertor',
-                        'preferedformat': format_type,
-                    }]
+                transfer = TransferTimer()
+                ydl_opts = build_download_opts(
+                    conversion_id, temp_dir, format_type, format_selector, filename_template,
+                    player_client=extractor['client'], transfer=transfer,
+                )
                 
                 conversion_status[conversion_id].status = f"Downloading with {extractor['name']}..."
                 
                 # Cloud-optimized delay
                 delay = random.uniform(1, 2) if is_cloud else random.uniform(3, 5)
                 print(f"⏱️ Cloud delay: {delay:.1f}s for attempt {i+1}")
-                time.sleep(delay)
+                with timed_stage('extractor_delay', conversion_id):
+                    time.sleep(delay)
                 
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([url])
+                started = time.monotonic()
+                with timed_download(transfer, conversion_id), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    downloaded_info = ydl.extract_info(url, download=True)
                 
                 # Check if download succeeded
-                all_files = os.listdir(temp_dir)
-                video_files = [f for f in all_files if not f.endswith('.info.json')]
-                
-                if video_files:
+                # Transfer time depends on the file, so only failures carry a latency
+                if list_output_files(temp_dir):
+                    record_extractor_attempt(extractor['name'], True, extractor['client'][0])
                     print(f"✅ Cloud download success with {extractor['name']}")
+                    downloaded = True
                     break
                 else:
+                    record_extractor_attempt(extractor['name'], False, extractor['client'][0],
+                                             time.monotonic() - started)
                     print(f"❌ No files with {extractor['name']}")
                     continue
                     
             except Exception as e:
+                if conversion_status[conversion_id].cancelled:
+                    raise
+                record_extractor_attempt(extractor['name'], False, extractor['client'][0],
+                                         time.monotonic() - started)
                 print(f"❌ {extractor['name']} failed: {str(e)}")
                 continue
-        else:
+        
+        if not downloaded:
             raise Exception("All cloud extraction methods failed")
         
         # Process downloaded files
         conversion_status[conversion_id].status = "Processing downloaded files..."
         
-        all_files = os.listdir(temp_dir)
-        video_files = [f for f in all_files if not f.endswith('.info.json')]
-        
-        if video_files:
-            main_file = max(video_files, key=lambda f: os.path.getsize(os.path.join(temp_dir, f)))
-            conversion_status[conversion_id].file_path = os.path.join(temp_dir, main_file)
-            
-            file_size_mb = os.path.getsize(conversion_status[conversion_id].file_path) / 1024 / 1024
-            
-            print(f"🎉 Cloud conversion complete: {main_file}")
-            print(f"📊 Final file size: {file_size_mb:.1f}MB")
-            
-            conversion_status[conversion_id].status = f"Cloud conversion complete - {file_size_mb:.1f}MB"
-            conversion_status[conversion_id].progress = 100
-        else:
+        video_files = list_output_files(temp_dir)
+        if not video_files:
             raise Exception("No video file found after cloud conversion")
         
+        main_file = max(video_files, key=lambda f: os.path.getsize(os.path.join(temp_dir, f)))
+        file_path = os.path.join(temp_dir, main_file)
+        metrics.observe('ytc_download_bytes', os.path.getsize(file_path))
+        
+        # Pick stream copy over re-encoding whenever the codecs allow it
+        path, postprocessors = plan_postprocessing(format_type, downloaded_info)
+        conversion_status[conversion_id].conversion_path = path
+        print(f"🧭 Conversion plan for {format_type}: {path}")
+        
+        if path == 'transcode':
+            return temp_dir, file_path, postprocessors
+        if path == 'remux':
+            conversion_status[conversion_id].status = f"Remuxing to {format_type.upper()} (stream copy)..."
+            with timed_stage('remux', conversion_id):
+                file_path = run_postprocessors(file_path, postprocessors)
+        
+        complete_conversion(conversion_id, temp_dir, file_path, url, format_type, quality)
+        
+    except Exception as e:
+        fail_conversion(conversion_id, e)
+    return None
+
+def perform_postprocess(conversion_id, temp_dir, file_path, postprocessors, url, format_type, quality):
+    """Postprocess stage: run the CPU-bound ffmpeg conversion on a downloaded file"""
+    try:
+        if conversion_status[conversion_id].cancelled:
+            raise ConversionCancelled(f"Conversion {conversion_id} cancelled")
+        
+        conversion_status[conversion_id].status = f"Converting to {format_type.upper()} with ffmpeg..."
+        print(f"🎞️ Postprocessing {os.path.basename(file_path)} -> {format_type}")
+        
+        with timed_stage('postprocess', conversion_id):
+            file_path = run_postprocessors(file_path, postprocessors)
+        
+        complete_conversion(conversion_id, temp_dir, file_path, url, format_type, quality)
+        
     except Exception as e:
-        conversion_status[conversion_id].error = str(e)
-        conversion_status[conversion_id].status = f"Cloud conversion error: {str(e)}"
-        print(f"❌ Cloud conversion error: {str(e)}")
+        fail_conversion(conversion_id, e)
+
+def complete_conversion(conversion_id, temp_dir, file_path, url, format_type, quality):
+    """Publish a finished file and mark the job complete"""
+    status = conversion_status[conversion_id]
+    status.file_path = file_path
+    
+    # Publish to the output cache so repeat requests are served instantly
+    video_id = extract_video_id(url)
+    if video_id:
+        try:
+            with timed_stage('publish', conversion_id):
+                cached_path = artifact_store.put(video_id, format_type, quality, file_path)
+            if cached_path:
+                file_path = cached_path
+                status.file_path = cached_path
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        except Exception as e:
+            print(f"⚠️ Output cache store failed: {str(e)}")
+    
+    file_size = os.path.getsize(file_path)
+    metrics.observe('ytc_output_bytes', file_size)
+    file_size_mb = file_size / 1024 / 1024
+    
+    print(f"🎉 Cloud conversion complete: {os.path.basename(file_path)}")
+    print(f"📊 Final file size: {file_size_mb:.1f}MB")
+    
+    status.update(status=f"Cloud conversion complete - {file_size_mb:.1f}MB", progress=100)
+
+def status_payload(conversion_id, status):
+    """JSON-serialisable snapshot of a conversion's progress"""
+    job = status.snapshot()
+    
+    file_size_mb = None
+    if job['file_path'] and os.path.exists(job['file_path']):
+        file_size_mb = os.path.getsize(job['file_path']) / 1024 / 1024
+    
+    queue_position = job['queue_position']
+    
+    return {
+        'progress': job['progress'],
+        'status': f"Queued (position {queue_position})..." if queue_position else job['status'],
+        'queue_position': queue_position,
+        'stage': job['stage'],
+        'conversion_path': job['conversion_path'],
+        'timings': job['timings'],
+        'stream_available': job['stream_path'] is not None and job['finished_at'] is None and not job['error'],
+        'queue_waits': {
+            'download': job['download_wait'],
+            'postprocess': job['postprocess_wait'],
+        },
+        'error': job['error'],
+        'completed': job['progress'] >= 100 and job['finished_at'] is not None and not job['error'],
+        'file_available': job['file_path'] is not None,
+        'file_size_mb': round(file_size_mb, 1) if file_size_mb else None,
+        'cloud_optimized': True
+    }
 
 @app.route('/api/status/<conversion_id>', methods=['GET'])
 def get_conversion_status(conversion_id):
@@ -465,36 +2114,479 @@ def get_conversion_status(conversion_id):
         return jsonify({'error': 'Conversion not found'}), 404
         
     status = conversion_status[conversion_id]
+    status.last_seen = time.time()
+    return jsonify(status_payload(conversion_id, status))
+
+@app.route('/api/convert/<conversion_id>', methods=['DELETE'])
+def cancel_conversion(conversion_id):
+    """Cancel a conversion, aborting its download or ffmpeg run"""
+    status = conversion_status.get(conversion_id)
+    if status is None:
+        return jsonify({'error': 'Conversion not found'}), 404
+    if status.finished_at is not None:
+        return jsonify({'error': 'Conversion already finished'}), 409
     
-    file_size_mb = None
-    if status.file_path and os.path.exists(status.file_path):
-        file_size_mb = os.path.getsize(status.file_path) / 1024 / 1024
+    # Other callers are attached to the same work; just detach this one
+    detached = set(status.detached or [])
+    others = [cid for cid in conversion_status.conversion_ids(conversion_id)
+              if cid != conversion_id and cid not in detached]
+    if others:
+        if conversion_id == status.job_id:
+            # Workers address the job by the leader's ID, so that mapping must stay
+            status.detached = sorted(detached | {conversion_id})
+        else:
+            conversion_status.remove([conversion_id])
+        print(f"✂️ Detached {conversion_id} from shared conversion {status.job_id}")
+        return jsonify({'conversion_id': conversion_id, 'cancelled': True, 'detached': True})
     
-    return jsonify({
-        'progress': status.progress,
-        'status': status.status,
-        'error': status.error,
-        'completed': status.progress >= 100 and not status.error,
-        'file_available': status.file_path is not None,
-        'file_size_mb': round(file_size_mb, 1) if file_size_mb else None,
-        'cloud_optimized': True
-    })
+    cancel_job(status.job_id)
+    print(f"🛑 Cancelled conversion {conversion_id}")
+    return jsonify({'conversion_id': conversion_id, 'cancelled': True, 'detached': False})
+
+class StreamSlots:
+    """Counting limit on concurrent streaming responses"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.active >= self.limit:
+                self.rejected += 1
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    def hold(self, response):
+        """Release the slot when the server closes the response, however it ends"""
+        response.call_on_close(self.release)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {'active': self.active, 'limit': self.limit, 'rejected': self.rejected}
+
+stream_slots = StreamSlots(MAX_STREAMING_RESPONSES)
+
+def streams_busy_response():
+    response = jsonify({'error': 'Too many open streams, poll instead', 'retry_after': STREAM_RETRY_AFTER})
+    response.headers['Retry-After'] = str(STREAM_RETRY_AFTER)
+    return response, 503
+
+@app.route('/api/status/<conversion_id>/events', methods=['GET'])
+def stream_conversion_status(conversion_id):
+    """Push conversion status as Server-Sent Events until the job finishes"""
+    if conversion_id not in conversion_status:
+        return jsonify({'error': 'Conversion not found'}), 404
+    
+    status = conversion_status[conversion_id]
+    
+    def generate():
+        last_payload = None
+        while True:
+            version = status.version
+            status.last_seen = time.time()
+            payload = status_payload(conversion_id, status)
+            if payload != last_payload:
+                yield f"data: {json.dumps(payload)}\n\n"
+                last_payload = payload
+            else:
+                yield ": keepalive\n\n"
+            if status.finished_at is not None or conversion_id not in conversion_status:
+                yield "event: end\ndata: {}\n\n"
+                return
+            
+            # Throttle: coalesce bursts of progress_hook updates into one event
+            waited_from = time.monotonic()
+            status.wait_for_change(version, SSE_KEEPALIVE_INTERVAL)
+            remaining = SSE_MIN_INTERVAL - (time.monotonic() - waited_from)
+            if remaining > 0:
+                time.sleep(remaining)
+    
+    # EventSource treats a 503 as an error, which starts the polling fallback
+    if not stream_slots.acquire():
+        return streams_busy_response()
+    return stream_slots.hold(Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    }))
+
+def artifact_etag(file_path, stat_result):
+    """Strong ETag for a finished file: its path, size and modification time"""
+    fingerprint = f"{file_path}:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+    return hashlib.sha256(fingerprint.encode()).hexdigest()[:32]
+
+def accel_redirect_response(file_path, etag, stat_result):
+    """Hand the transfer to nginx via X-Accel-Redirect, or None if not applicable"""
+    relative = os.path.relpath(file_path, ACCEL_REDIRECT_ROOT)
+    if relative.startswith(os.pardir):
+        return None
+    
+    filename = os.path.basename(file_path)
+    response = Response(status=200)
+    response.headers['X-Accel-Redirect'] = f"{ACCEL_REDIRECT_PREFIX.rstrip('/')}/{quote(relative)}"
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    response.headers['Content-Type'] = 'application/octet-stream'
+    response.set_etag(etag)
+    response.last_modified = stat_result.st_mtime
+    return response
+
+def tail_download(status, stream_file):
+    """Yield a file's bytes as the downloader appends them, until the job ends"""
+    # The streaming client is still here, so the job is not abandoned
+    heartbeat = max(min(1.0, ABANDONED_JOB_TIMEOUT / 4), 0.05)
+    touched = 0
+    with stream_file:
+        while True:
+            if time.time() - touched >= heartbeat:
+                touched = time.time()
+                status.last_seen = touched
+            version = status.version
+            chunk = stream_file.read(STREAM_CHUNK_SIZE)
+            if chunk:
+                yield chunk
+                continue
+            # yt-dlp renames the .part file when done; our descriptor keeps reading it
+            if status.error:
+                return
+            if status.file_path is not None or status.finished_at is not None:
+                chunk = stream_file.read()
+                while chunk:
+                    yield chunk
+                    chunk = stream_file.read(STREAM_CHUNK_SIZE)
+                return
+            status.wait_for_change(version, heartbeat)
+
+def progressive_response(status):
+    """Stream a still-downloading file, or None if this job cannot be streamed
+
+    Returns a 503 when every streaming slot is taken.
+    """
+    if not status.stream_path or status.error:
+        return None
+    if not stream_slots.acquire():
+        return streams_busy_response()
+    try:
+        stream_file = open(status.stream_path, 'rb')
+    except OSError:
+        stream_slots.release()
+        return None
+    
+    filename = os.path.basename(status.stream_path)
+    if filename.endswith('.part'):
+        filename = filename[:-len('.part')]
+    headers = {
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}",
+        'Accept-Ranges': 'none',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    }
+    if status.stream_total_bytes:
+        headers['Content-Length'] = str(status.stream_total_bytes)
+    status.downloaded_at = time.time()
+    print(f"📡 Streaming {filename} while it downloads")
+    return stream_slots.hold(
+        Response(tail_download(status, stream_file), mimetype='application/octet-stream', headers=headers)
+    )
 
 @app.route('/api/download/<conversion_id>', methods=['GET'])
 def download_file(conversion_id):
-    """Download converted file"""
+    """Download converted file with Range, If-Range and conditional GET support
+
+    While a progressive mp4/webm is still downloading, its bytes are
+    streamed to the client as they arrive instead.
+    """
     if conversion_id not in conversion_status:
         return jsonify({'error': 'Conversion not found'}), 404
         
     status = conversion_status[conversion_id]
+    status.last_seen = time.time()
     if not status.file_path or not os.path.exists(status.file_path):
+        response = progressive_response(status)
+        if response is not None:
+            return response
         return jsonify({'error': 'File not ready'}), 404
+    
+    status.downloaded_at = time.time()
+    artifact_store.touch(status.file_path)
+    try:
+        stat_result = os.stat(status.file_path)
+        etag = artifact_etag(status.file_path, stat_result)
         
-    return send_file(
-        status.file_path,
-        as_attachment=True,
-        download_name=os.path.basename(status.file_path)
-    )
+        # Behind nginx, let the proxy serve the bytes (it handles ranges itself)
+        if ACCEL_REDIRECT_PREFIX:
+            response = accel_redirect_response(status.file_path, etag, stat_result)
+            if response is not None:
+                return response.make_conditional(request)
+            
+        # Otherwise werkzeug answers 206/304/412 and uses the server's sendfile wrapper
+        return send_file(
+            status.file_path,
+            as_attachment=True,
+            download_name=os.path.basename(status.file_path),
+            conditional=True,
+            etag=etag,
+            last_modified=stat_result.st_mtime,
+        )
+    except FileNotFoundError:
+        # Reaped or evicted between the checks above and opening it
+        return jsonify({'error': 'File no longer available'}), 404
+
+class ConversionBatch:
+    """A list of URLs fed into the conversion pipeline a few at a time
+
+    The batch record lives in the job store so every worker process can
+    report on it and stream its ZIP; only the process that created it runs
+    the feeder, which saves the record whenever an item starts or fails.
+    """
+
+    RECORD_FIELDS = ('batch_id', 'client', 'format_type', 'quality', 'max_concurrency', 'created_at', 'items')
+
+    def __init__(self, batch_id, urls, format_type, quality, max_concurrency, client=None):
+        self.batch_id = batch_id
+        self.client = client
+        self.format_type = format_type
+        self.quality = quality
+        self.max_concurrency = max_concurrency
+        self.created_at = time.time()
+        self.items = [{'url': url, 'conversion_id': None, 'error': None} for url in urls]
+
+    @classmethod
+    def load(cls, batch_id):
+        record = conversion_status.get_batch(batch_id)
+        if record is None:
+            return None
+        batch = cls.__new__(cls)
+        batch.__dict__.update(record)
+        return batch
+
+    def save(self):
+        conversion_status.save_batch(self.batch_id, {name: getattr(self, name) for name in self.RECORD_FIELDS})
+
+    def refresh(self):
+        """Pick up items started by the feeder, which may run in another process"""
+        record = conversion_status.get_batch(self.batch_id)
+        if record is not None:
+            self.items = record['items']
+
+    def start(self):
+        self.save()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _finished(self, item):
+        if item['error']:
+            return True
+        if not item['conversion_id']:
+            return False
+        status = conversion_status.get(item['conversion_id'])
+        return status is None or status.finished_at is not None
+
+    def _run(self):
+        # Keep at most max_concurrency items of this batch queued or running
+        waiting = list(self.items)
+        while True:
+            running = [item for item in self.items if item['conversion_id'] and not self._finished(item)]
+            while waiting and len(running) < self.max_concurrency:
+                item = waiting[0]
+                try:
+                    item['conversion_id'] = start_conversion(
+                        item['url'], self.format_type, self.quality, self.client
+                    )['conversion_id']
+                    running.append(item)
+                except QueueFullError:
+                    break  # Pool is saturated; try again on the next tick
+                except Exception as e:
+                    item['error'] = str(e)
+                waiting.pop(0)
+                self.save()
+            if not waiting and not running:
+                print(f"📦 Batch {self.batch_id} finished")
+                return
+            time.sleep(BATCH_POLL_INTERVAL)
+
+    def summary(self):
+        items = []
+        for item in self.items:
+            entry = {'url': item['url'], 'conversion_id': item['conversion_id']}
+            status = conversion_status.get(item['conversion_id']) if item['conversion_id'] else None
+            if item['error']:
+                entry.update({'progress': 0, 'status': 'Failed to start', 'completed': False, 'error': item['error']})
+            elif status is not None:
+                status.last_seen = time.time()
+                payload = status_payload(item['conversion_id'], status)
+                entry.update({key: payload[key] for key in ('progress', 'status', 'completed', 'error')})
+            else:
+                entry.update({'progress': 0, 'status': 'Waiting in batch...', 'completed': False, 'error': None})
+            items.append(entry)
+        
+        completed = sum(1 for item in items if item['completed'])
+        failed = sum(1 for item in items if item['error'])
+        return {
+            'batch_id': self.batch_id,
+            'total': len(items),
+            'completed': completed,
+            'failed': failed,
+            'pending': len(items) - completed - failed,
+            'progress': round(sum(item['progress'] for item in items) / len(items), 1) if items else 100,
+            'finished': all(self._finished(item) for item in self.items),
+            'items': items,
+        }
+
+class ZipStream:
+    """Write-only file object that hands zipfile output to a response generator"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_batch_zip(batch):
+    """Yield a ZIP of the batch's files, adding each item as soon as it finishes"""
+    stream = ZipStream()
+    written = set()
+    names = set()
+    # Media is already compressed, so store entries and just copy bytes through
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        while True:
+            batch.refresh()
+            ready = [item for item in batch.items
+                     if item['conversion_id'] not in written and batch._finished(item)]
+            for item in ready:
+                written.add(item['conversion_id'])
+                status = conversion_status.get(item['conversion_id']) if item['conversion_id'] else None
+                if status is None or status.error or not status.file_path or not os.path.exists(status.file_path):
+                    continue
+                status.downloaded_at = time.time()
+                
+                name = os.path.basename(status.file_path)
+                base, ext = os.path.splitext(name)
+                counter = 2
+                while name in names:
+                    name = f"{base} ({counter}){ext}"
+                    counter += 1
+                names.add(name)
+                
+                with open(status.file_path, 'rb') as source, archive.open(name, 'w', force_zip64=True) as target:
+                    for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                        target.write(chunk)
+                        yield stream.drain()
+                yield stream.drain()
+            if len(written) == len(batch.items):
+                break
+            if not ready:
+                # The ZIP client is still here, so its pending items are not abandoned
+                for item in batch.items:
+                    status = conversion_status.get(item['conversion_id']) if item['conversion_id'] else None
+                    if status is not None and status.finished_at is None:
+                        status.last_seen = time.time()
+                time.sleep(BATCH_POLL_INTERVAL)
+    yield stream.drain()
+
+def extract_playlist_urls(url):
+    """Flat-extract a playlist into watch URLs without resolving each video"""
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'extract_flat': 'in_playlist'}) as ydl:
+        info = ydl.extract_info(url, download=False)
+    urls = []
+    for entry in info.get('entries') or []:
+        if entry and entry.get('id'):
+            urls.append(entry.get('url') or f"https://www.youtube.com/watch?v={entry['id']}")
+    return urls
+
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    """Convert a list of URLs or a playlist, a few items at a time"""
+    try:
+        data = request.get_json()
+        urls = data.get('urls') or []
+        format_type = data.get('format', 'mp4')
+        quality = data.get('quality', '1080p')
+        
+        if data.get('playlist'):
+            print(f"📜 Expanding playlist: {data['playlist']}")
+            urls = urls + extract_playlist_urls(data['playlist'])
+        
+        if not urls:
+            return jsonify({'error': 'A list of URLs or a playlist is required'}), 400
+        if len(urls) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'Batches are limited to {BATCH_MAX_ITEMS} items'}), 400
+        
+        batch_id = f"batch_{int(time.time())}_{uuid.uuid4().hex[:12]}"
+        concurrency = min(int(data.get('concurrency', BATCH_MAX_CONCURRENCY)), BATCH_MAX_CONCURRENCY)
+        batch = ConversionBatch(batch_id, urls, format_type, quality, max(concurrency, 1), request_client_id())
+        batch.start()
+        
+        print(f"📦 Started batch {batch_id}: {len(urls)} items, {format_type.upper()} @ {quality.upper()}")
+        return jsonify({
+            'batch_id': batch_id,
+            'total': len(urls),
+            'status': 'started',
+            'concurrency': batch.max_concurrency,
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Batch failed: {str(e)}'}), 500
+
+@app.route('/api/batch/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    """Aggregate progress of a batch and its items"""
+    batch = ConversionBatch.load(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify(batch.summary())
+
+@app.route('/api/batch/<batch_id>/download', methods=['GET'])
+def download_batch(batch_id):
+    """Stream the batch results as a ZIP built on the fly"""
+    batch = ConversionBatch.load(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    if not stream_slots.acquire():
+        return streams_busy_response()
+    return stream_slots.hold(Response(stream_batch_zip(batch), mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="{batch_id}.zip"',
+        'X-Accel-Buffering': 'no',
+    }))
+
+def cache_hit_ratio(cache_stats):
+    lookups = cache_stats['hits'] + cache_stats['misses']
+    return cache_stats['hits'] / lookups if lookups else 0.0
+
+metrics.gauge('ytc_queue_depth', 'Jobs waiting in each scheduler queue', lambda: {
+    (('pool', pool.name),): pool.stats()['pending'] for pool in (scheduler, postprocess_scheduler)
+})
+metrics.gauge('ytc_active_workers', 'Busy workers in each scheduler pool', lambda: {
+    (('pool', pool.name),): pool.stats()['active'] for pool in (scheduler, postprocess_scheduler)
+})
+metrics.gauge('ytc_cache_hit_ratio', 'Hit ratio of the metadata and output caches', lambda: {
+    (('cache', 'video_info'),): cache_hit_ratio(video_info_cache.stats()),
+    (('cache', 'output'),): cache_hit_ratio(artifact_store.stats()),
+})
+metrics.gauge('ytc_scratch_disk_bytes', 'Bytes used by job scratch directories', lambda: directory_size(SCRATCH_DIR))
+metrics.gauge('ytc_output_cache_bytes', 'Bytes used by the output cache', lambda: artifact_store.stats()['bytes'])
+metrics.gauge('ytc_jobs', 'Conversion IDs currently tracked by the job store', lambda: len(conversion_status))
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics for this process"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -503,9 +2595,27 @@ def health_check():
         'status': 'healthy', 
         'message': 'Cloud-Optimized YouTube Converter API',
         'environment': 'cloud' if is_cloud_environment() else 'local',
+        'scheduler': {
+            'download': scheduler.stats(),
+            'postprocess': postprocess_scheduler.stats(),
+        },
+        'video_info_cache': video_info_cache.stats(),
+        'output_cache': artifact_store.stats(),
+        'single_flight': in_flight.stats(),
+        'streams': stream_slots.stats(),
+        'extractors': extractor_scoreboard.stats(),
+        'startup': {
+            'module_load_seconds': round(STARTUP_SECONDS, 3),
+            'yt_dlp_import_seconds': yt_dlp.import_seconds,
+        },
+        'janitor': janitor.stats(),
         'features': ['api_key_rotation', 'fast_extraction', 'cloud_optimized', 'no_browser_cookies']
     })
 
+STARTUP_SECONDS = time.perf_counter() - STARTUP_BEGAN
+metrics.gauge('ytc_startup_seconds', 'Time taken to load the backend module', lambda: round(STARTUP_SECONDS, 3))
+print(f"⚡ Backend loaded in {STARTUP_SECONDS * 1000:.0f}ms (pid {os.getpid()})")
+
 if __name__ == '__main__':
     print("🚀 Starting Cloud-Optimized YouTube Converter Backend...")
     print("📡 API available at: https://convert-youtube.onrender.com")
@@ -0,0 +1,374 @@
+# benchmark.py - Offline load test for backend_server.py (no YouTube traffic)
+#
+# Replaces yt_dlp.YoutubeDL with a local stub that serves synthetic videos,
+# runs the real Flask app on a loopback port and drives the API concurrently:
+#
+#   python benchmark.py --users 16 --jobs 4 --file-size 8M --rate 20M
+#
+# Each virtual user is its own client (sent as X-Forwarded-For); --clients
+# packs the users into fewer clients to exercise the per-client limits:
+#
+#   python benchmark.py --users 16 --clients 2 --max-client-pending 4
+#
+# Reports requests/s, p50/p99 latency per endpoint and outcomes per client,
+# peak RSS and open fds.
+# Linux only (reads /proc/self/fd).
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import logging
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import defaultdict
+
+import yt_dlp
+
+class StubYoutubeDL:
+    """Stand-in for yt_dlp.YoutubeDL that writes synthetic media at a fixed rate"""
+
+    file_size = 4 * 1024 * 1024
+    rate = 32 * 1024 * 1024  # bytes/s per download
+    chunk_size = 256 * 1024
+    extract_time = 0.05
+    postprocess_time = 0.2
+    failure_rate = 0.0
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def extract_info(self, url, download=True):
+        time.sleep(self.extract_time)
+        if random.random() < self.failure_rate:
+            raise yt_dlp.utils.DownloadError(f"Stub extraction failure for {url}")
+        match = re.search(r'(?:v=|youtu\.be/)([\w-]+)', url)
+        video_id = match.group(1) if match else 'stub'
+        info = {
+            'id': video_id,
+            'title': f'Stub video {video_id}',
+            'duration': 60 + sum(map(ord, video_id)) % 600,
+            'uploader': 'benchmark',
+            'view_count': 0,
+            'thumbnail': None,
+            'ext': 'mp4',
+            'vcodec': 'avc1.64001F',
+            'acodec': 'mp4a.40.2',
+            'webpage_url': url,
+            'extractor': 'youtube',
+            'formats': [{
+                'format_id': '18',
+                'ext': 'mp4',
+                'vcodec': 'avc1.64001F',
+                'acodec': 'mp4a.40.2',
+                'height': 360,
+                'filesize': self.file_size,
+                'url': f'https://stub.invalid/{video_id}?expire={int(time.time()) + 6 * 3600}',
+            }],
+        }
+        if download:
+            self._download(info)
+        return info
+
+    def process_ie_result(self, info, download=True):
+        if download:
+            self._download(info)
+        return info
+
+    def sanitize_info(self, info):
+        return info
+
+    def run_pp(self, pp, info):
+        # Simulated encode; the output stays in place
+        time.sleep(self.postprocess_time)
+        return info
+
+    def _download(self, info):
+        outtmpl = self.params.get('outtmpl', '%(title)s.%(ext)s')
+        if isinstance(outtmpl, dict):
+            outtmpl = outtmpl['default']
+        filename = re.sub(r'%\((\w+)\)s', lambda m: str(info.get(m.group(1), m.group(1))), outtmpl)
+        tmpfilename = filename + '.part'
+        hooks = self.params.get('progress_hooks', [])
+        chunk = b'\0' * self.chunk_size
+        written = 0
+        started = time.monotonic()
+        with open(tmpfilename, 'wb') as f:
+            while written < self.file_size:
+                size = min(self.chunk_size, self.file_size - written)
+                f.write(chunk[:size])
+                f.flush()
+                written += size
+                for hook in hooks:
+                    hook({'status': 'downloading', 'downloaded_bytes': written, 'total_bytes': self.file_size,
+                          'tmpfilename': tmpfilename, 'filename': filename, 'info_dict': info})
+                # Pace the writes to the configured transfer rate
+                ahead = written / self.rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        os.rename(tmpfilename, filename)
+        for hook in hooks:
+            hook({'status': 'finished', 'filename': filename, 'total_bytes': self.file_size, 'info_dict': info})
+
+class ResourceSampler:
+    """Track peak open file descriptors and RSS of this process"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_fds = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_fds = max(self.peak_fds, len(os.listdir('/proc/self/fd')))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    @staticmethod
+    def peak_rss_mb():
+        # ru_maxrss is reported in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class LoadGenerator:
+    """Virtual users that each run video-info -> convert -> status polling -> download"""
+
+    def __init__(self, port, args):
+        self.port = port
+        self.args = args
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.status_codes = defaultdict(lambda: defaultdict(int))
+        self.outcomes = defaultdict(int)
+        self.client_outcomes = defaultdict(lambda: defaultdict(int))
+        self.downloaded_bytes = 0
+        self.local = threading.local()
+
+    def client_address(self, index):
+        """Address this user presents; users share one when there are fewer clients"""
+        client = index % (self.args.clients or self.args.users) + 1
+        return f"10.{client >> 16 & 255}.{client >> 8 & 255}.{client & 255}"
+
+    def request(self, conn, endpoint, method, path, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        headers['X-Forwarded-For'] = self.local.address
+        started = time.perf_counter()
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = conn.getresponse()
+        payload = response.read()
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            self.status_codes[endpoint][response.status] += 1
+        return response.status, payload
+
+    def user(self, index):
+        self.local.address = self.client_address(index)
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.args.timeout)
+        try:
+            for job in range(self.args.jobs):
+                video_id = f"bench{(index * self.args.jobs + job) % self.args.distinct_videos:06d}"
+                self.run_job(conn, f"https://www.youtube.com/watch?v={video_id}")
+        finally:
+            conn.close()
+
+    def run_job(self, conn, url):
+        self.request(conn, 'video-info', 'POST', '/api/video-info', {'url': url})
+        code, payload = self.request(conn, 'convert', 'POST', '/api/convert', {
+            'url': url, 'format': self.args.format, 'quality': self.args.quality,
+        })
+        if code != 200:
+            self.record('rejected' if code == 429 else 'convert_error')
+            return
+        conversion_id = json.loads(payload)['conversion_id']
+        deadline = time.monotonic() + self.args.timeout
+        while time.monotonic() < deadline:
+            _, payload = self.request(conn, 'status', 'GET', f'/api/status/{conversion_id}')
+            status = json.loads(payload)
+            if status.get('error'):
+                self.record('failed')
+                return
+            if status.get('completed'):
+                break
+            time.sleep(self.args.poll_interval)
+        else:
+            self.record('timeout')
+            return
+        code, payload = self.request(conn, 'download', 'GET', f'/api/download/{conversion_id}')
+        with self.lock:
+            self.downloaded_bytes += len(payload)
+        self.record('completed' if code == 200 else 'download_error')
+
+    def record(self, outcome):
+        with self.lock:
+            self.outcomes[outcome] += 1
+            self.client_outcomes[self.local.address][outcome] += 1
+
+    def run(self):
+        threads = [threading.Thread(target=self.user, args=(i,), daemon=True) for i in range(self.args.users)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def parse_size(text):
+    """Parse sizes like 512K, 8M or 1G"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the converter backend")
+    parser.add_argument('--users', type=int, default=8, help="concurrent virtual users")
+    parser.add_argument('--jobs', type=int, default=4, help="conversions per user")
+    parser.add_argument('--clients', type=int, default=0,
+                        help="distinct client addresses the users are spread over (0 = one per user)")
+    parser.add_argument('--max-client-pending', type=int, default=None,
+                        help="override MAX_CLIENT_PENDING_CONVERSIONS; rejections then count as expected")
+    parser.add_argument('--distinct-videos', type=int, default=1000000,
+                        help="number of distinct video IDs; lower values exercise the caches")
+    parser.add_argument('--format', default='mp4', help="output format to request")
+    parser.add_argument('--quality', default='best')
+    parser.add_argument('--file-size', type=parse_size, default='4M', help="synthetic media size")
+    parser.add_argument('--rate', type=parse_size, default='32M', help="download rate per job, bytes/s")
+    parser.add_argument('--extract-time', type=float, default=0.05, help="stub extraction latency, seconds")
+    parser.add_argument('--postprocess-time', type=float, default=0.2, help="stub encode time, seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of stub extractions that fail")
+    parser.add_argument('--delay-scale', type=float, default=0.0,
+                        help="scale for the backend's randomized anti-bot delays (1 = production)")
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    parser.add_argument('--verbose', action='store_true', help="keep the backend's own logging")
+    return parser.parse_args(argv)
+
+def load_backend(args, scratch):
+    """Import backend_server against the stub, with throwaway scratch/cache directories"""
+    os.environ.setdefault('SCRATCH_DIR', os.path.join(scratch, 'jobs'))
+    os.environ.setdefault('OUTPUT_CACHE_DIR', os.path.join(scratch, 'cache'))
+    os.environ.setdefault('JOB_STORE_PATH', os.path.join(scratch, 'jobs.db'))
+    # Clients are told apart by the X-Forwarded-For each virtual user sends
+    os.environ.setdefault('TRUSTED_PROXY_HOPS', '1')
+    if args.max_client_pending is not None:
+        os.environ['MAX_CLIENT_PENDING_CONVERSIONS'] = str(args.max_client_pending)
+
+    StubYoutubeDL.file_size = args.file_size
+    StubYoutubeDL.rate = args.rate
+    StubYoutubeDL.extract_time = args.extract_time
+    StubYoutubeDL.postprocess_time = args.postprocess_time
+    StubYoutubeDL.failure_rate = args.failure_rate
+    yt_dlp.YoutubeDL = StubYoutubeDL
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import backend_server
+
+    # The anti-bot delays come from random.uniform(); scale them without touching other sleeps
+    uniform = random.Random().uniform
+    backend_server.random = types.SimpleNamespace(
+        choice=random.choice,
+        uniform=lambda a, b: uniform(a, b) * args.delay_scale,
+    )
+    return backend_server
+
+def report(args, elapsed, generator, sampler):
+    total_requests = sum(len(values) for values in generator.latencies.values())
+    endpoints = {}
+    for endpoint, values in generator.latencies.items():
+        endpoints[endpoint] = {
+            'requests': len(values),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'max_ms': round(max(values) * 1000, 2),
+            'status_codes': dict(generator.status_codes[endpoint]),
+        }
+    return {
+        'users': args.users,
+        'clients': len(generator.client_outcomes),
+        'jobs_per_user': args.jobs,
+        'elapsed_s': round(elapsed, 3),
+        'requests': total_requests,
+        'requests_per_s': round(total_requests / elapsed, 1) if elapsed else 0,
+        'conversions_per_s': round(generator.outcomes['completed'] / elapsed, 2) if elapsed else 0,
+        'outcomes': dict(generator.outcomes),
+        'client_outcomes': {client: dict(outcomes) for client, outcomes in sorted(generator.client_outcomes.items())},
+        'downloaded_mb': round(generator.downloaded_bytes / 1024 / 1024, 1),
+        'peak_rss_mb': round(sampler.peak_rss_mb(), 1),
+        'peak_open_fds': sampler.peak_fds,
+        'endpoints': endpoints,
+    }
+
+def print_report(result):
+    print(f"⏱️ {result['requests']} requests in {result['elapsed_s']}s "
+          f"({result['requests_per_s']} req/s, {result['conversions_per_s']} conversions/s)")
+    print(f"📊 Outcomes: {result['outcomes']}  downloaded: {result['downloaded_mb']} MB")
+    if result['clients'] < result['users']:
+        for client, outcomes in result['client_outcomes'].items():
+            print(f"   {client:<14}{outcomes}")
+    print(f"💾 Peak RSS: {result['peak_rss_mb']} MB  peak open fds: {result['peak_open_fds']}")
+    print(f"{'endpoint':<12}{'requests':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}  status codes")
+    for endpoint, stats in result['endpoints'].items():
+        print(f"{endpoint:<12}{stats['requests']:>10}{stats['p50_ms']:>10}{stats['p99_ms']:>10}"
+              f"{stats['max_ms']:>10}  {stats['status_codes']}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    scratch = tempfile.mkdtemp(prefix='ytc_bench_')
+    try:
+        backend_server = load_backend(args, scratch)
+        from werkzeug.serving import make_server
+
+        server = make_server('127.0.0.1', 0, backend_server.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        generator = LoadGenerator(server.server_port, args)
+
+        if not args.verbose:
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with ResourceSampler() as sampler, quiet:
+            elapsed = generator.run()
+        server.shutdown()
+
+        result = report(args, elapsed, generator, sampler)
+        if args.json:
+            print(json.dumps(result, indent=2))
+        else:
+            print_report(result)
+        # Rejections are the point when the per-client limits are being exercised
+        expected = {'completed', 'rejected'} if args.clients or args.max_client_pending is not None else {'completed'}
+        return 0 if set(generator.outcomes) <= expected else 1
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
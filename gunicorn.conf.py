@@ -0,0 +1,20 @@
+# gunicorn.conf.py - Production server settings (used by render.yaml)
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# SSE, progressive downloads and batch ZIPs hold a thread each for their
+# whole lifetime; the backend caps them at MAX_STREAMING_RESPONSES (default 8)
+# so the remaining threads stay free for short requests
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+# Load the app once in the master; workers are forked with it already imported
+preload_app = True
+
+def when_ready(server):
+    # Runs in the master before any worker is forked, so the yt-dlp import
+    # and extractor setup are paid once instead of per worker boot
+    import backend_server
+    backend_server.warm_up()
+
+def post_worker_init(worker):
+    worker.log.info(f"⚡ Worker {worker.pid} ready")